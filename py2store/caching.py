@@ -0,0 +1,423 @@
+"""
+Caching layers for stores.
+
+The stores of py2store.simple and py2store.kv go to their persister (and deserialize what they get from it) at every
+read. When the same keys are read over and over (config blobs, models, lookup tables...), it's much cheaper to keep
+the deserialized objects around, in memory, and only go to the store when the object isn't there.
+
+Similarly, stores write to their persister at every assignment. When writes are frequent and small (metrics, logs...),
+it's cheaper to buffer them in memory, and write them in batches.
+"""
+
+import sys
+import time
+from collections import OrderedDict
+from threading import Event, Lock, RLock, Thread
+
+from py2misc.py2store.simple import Persister, items_of, getmany_of, setmany_of, delmany_of
+
+DFLT_MAX_ITEMS = 1024
+DFLT_MAX_PENDING_ITEMS = 1024
+
+
+class CachedStore(Persister):
+    """A read-through LRU cache of the values of a store.
+
+    Wraps any store (e.g. a py2store.simple.Store or a py2store.kv.Store), caching the objects that its __getitem__
+    returns (that is, the output of _obj_of_data), so that repeated reads of the same key skip both the I/O and the
+    deserialization.
+
+    The least recently read items are evicted when there are more than max_items items, or when the (approximate)
+    total size of the cached values goes over max_bytes. The size of a value is computed by the sizeof function
+    (sys.getsizeof by default, which is accurate for bytes, str and numpy arrays, but not for containers).
+
+    Writes and deletes are made on the wrapped store, and invalidate the cached value of the key. A value read from the
+    store while the key was being written (by another thread) isn't cached, since it may be the old one.
+    Writes and deletes made on the wrapped store directly (or by anyone else) will NOT invalidate the cache.
+
+    >>> class LoudDict(dict):
+    ...     def __getitem__(self, k):
+    ...         print(f"reading {k}")
+    ...         return super().__getitem__(k)
+    >>> s = CachedStore(LoudDict(a=1, b=2, c=3), max_items=2)
+    >>> s['a']
+    reading a
+    1
+    >>> s['a']  # this time, it's read from the cache
+    1
+    >>> s['b'], s['c']  # 'a' is evicted, since the cache only holds 2 items
+    reading b
+    reading c
+    (2, 3)
+    >>> s['a'] = 10  # a write goes to the store...
+    >>> s['a']  # ... so the next read goes to the store
+    reading a
+    10
+    >>> stats = s.stats()
+    >>> stats['hits'], stats['misses'], stats['evictions'], stats['n_items']
+    (1, 4, 2, 2)
+    """
+
+    def __init__(self, store, max_items=DFLT_MAX_ITEMS, max_bytes=None, sizeof=sys.getsizeof):
+        self.store = store
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self._cache = OrderedDict()  # key -> (val, size), least recently used first
+        self._n_bytes = 0
+        self._reads = {}  # key -> [number of reads from the store in flight, number of writes since the first began]
+        self._lock = RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # Cache management ################################################################################################
+    def _cache_get(self, k):
+        with self._lock:
+            val, _ = self._cache[k]
+            self._cache.move_to_end(k)
+            self.hits += 1
+            return val
+
+    def _cache_set(self, k, v):
+        size = self.sizeof(v)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return  # too big to ever fit: don't cache it (it would just evict everything else)
+        with self._lock:
+            self._invalidate(k)
+            self._cache[k] = (v, size)
+            self._n_bytes += size
+            self._evict()
+
+    def _invalidate(self, k):
+        with self._lock:
+            if k in self._cache:
+                _, size = self._cache.pop(k)
+                self._n_bytes -= size
+
+    def _evict(self):
+        while len(self._cache) > self.max_items or (self.max_bytes is not None and self._n_bytes > self.max_bytes):
+            _, (_, size) = self._cache.popitem(last=False)
+            self._n_bytes -= size
+            self.evictions += 1
+
+    def _begin_reads(self, keys):
+        """Register reads of keys from the store (counting them as misses), and return the write counts of the keys,
+        to be given to _end_reads"""
+        with self._lock:
+            self.misses += len(keys)
+            n_writes = []
+            for k in keys:
+                reading = self._reads.setdefault(k, [0, 0])
+                reading[0] += 1
+                n_writes.append(reading[1])
+            return n_writes
+
+    def _end_reads(self, keys, n_writes, vals=None):
+        """Unregister reads of keys, caching the values read (if given) of the keys that weren't written meanwhile"""
+        with self._lock:
+            for i, (k, n) in enumerate(zip(keys, n_writes)):
+                reading = self._reads[k]
+                if vals is not None and reading[1] == n:
+                    self._cache_set(k, vals[i])
+                reading[0] -= 1
+                if reading[0] == 0:
+                    del self._reads[k]
+
+    def _written(self, k):
+        """Invalidate k after it was written (or deleted), and let the reads of k in flight know they may be stale"""
+        with self._lock:
+            self._invalidate(k)
+            reading = self._reads.get(k)
+            if reading is not None:
+                reading[1] += 1
+
+    def invalidate_all(self):
+        """Empty the cache (not the store!)"""
+        with self._lock:
+            self._cache.clear()
+            self._n_bytes = 0
+
+    def stats(self):
+        """A snapshot of the cache's counters"""
+        return dict(hits=self.hits, misses=self.misses, evictions=self.evictions,
+                    n_items=len(self._cache), n_bytes=self._n_bytes)
+
+    # Read ############################################################################################################
+    def __getitem__(self, k):
+        try:
+            return self._cache_get(k)
+        except KeyError:
+            pass
+        n_writes = self._begin_reads([k])
+        vals = None
+        try:
+            vals = [self.store[k]]
+        finally:
+            self._end_reads([k], n_writes, vals)
+        return vals[0]
+
+    def getmany(self, keys):
+        keys = list(keys)
+        vals = {}
+        missing_keys = []
+        for k in keys:
+            try:
+                vals[k] = self._cache_get(k)
+            except KeyError:
+                missing_keys.append(k)
+        if missing_keys:
+            n_writes = self._begin_reads(missing_keys)
+            missing_vals = None
+            try:
+                missing_vals = getmany_of(self.store, missing_keys)
+            finally:
+                self._end_reads(missing_keys, n_writes, missing_vals)
+            vals.update(zip(missing_keys, missing_vals))
+        return [vals[k] for k in keys]
+
+    # Explore #########################################################################################################
+    def __iter__(self):
+        return iter(self.store)
+
+    def __len__(self):
+        return len(self.store)
+
+    def __contains__(self, k):
+        return k in self._cache or k in self.store
+
+    # Write and delete (invalidate the cache) #########################################################################
+    # (A key is invalidated before its write, so that it's not served from the cache while it's written, and after it,
+    # since a read of the old value may have been cached meanwhile)
+    def __setitem__(self, k, v):
+        self._invalidate(k)
+        try:
+            self.store[k] = v
+        finally:
+            self._written(k)
+
+    def __delitem__(self, k):
+        self._invalidate(k)
+        try:
+            del self.store[k]
+        finally:
+            self._written(k)
+
+    def setmany(self, items):
+        items = list(items_of(items))
+        for k, _ in items:
+            self._invalidate(k)
+        try:
+            setmany_of(self.store, items)
+        finally:
+            for k, _ in items:
+                self._written(k)
+
+    def delmany(self, keys):
+        keys = list(keys)
+        for k in keys:
+            self._invalidate(k)
+        try:
+            delmany_of(self.store, keys)
+        finally:
+            for k in keys:
+                self._written(k)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.store!r}, max_items={self.max_items}, max_bytes={self.max_bytes})"
+
+
+class WriteBackStore(Persister):
+    """A write-back buffer for the writes of a store.
+
+    Writes are kept in memory (several writes to the same key only keep the last value) and written to the wrapped
+    store in a batch (with its setmany method, if it has one) when:
+        - there are more than max_pending_items pending writes,
+        - the (approximate, as computed by sizeof) total size of pending values is more than max_pending_bytes,
+        - the oldest pending write is older than max_pending_seconds,
+        - flush() (or close()) is called explicitly, or the context manager exits.
+    The item and byte thresholds are checked when writing. The age of pending writes is checked by a background
+    (daemon) thread, started at the first write if max_pending_seconds is given, so that writes are flushed even
+    during a pause in writes: close() stops it (after a last flush).
+
+    Pending items are written outside the lock, so reads and writes aren't blocked while the store is written to
+    (items being written are still read from the buffer). If writing them fails, they're kept pending (unless written
+    again since), and the error is raised (by the background thread's flushes, it's raised by the next flush).
+
+    Reads of pending keys are served from the buffer. Listing (__iter__ and __len__) flushes first.
+    Deletes are not buffered.
+
+    >>> class LoudDict(dict):
+    ...     def setmany(self, items):
+    ...         print(f"writing {len(items)} items")
+    ...         self.update(items)
+    >>> d = LoudDict()
+    >>> with WriteBackStore(d, max_pending_items=3) as s:
+    ...     for i in range(5):
+    ...         s['a'] = i  # these only update the buffer
+    ...     s['b'] = 1
+    ...     s['c'] = 2
+    ...     assert s['a'] == 4 and len(d) == 0  # pending writes are read from the buffer
+    ...     s['d'] = 3  # one item too many: write them all
+    ...     s['e'] = 4
+    writing 4 items
+    writing 1 items
+    >>> d
+    {'a': 4, 'b': 1, 'c': 2, 'd': 3, 'e': 4}
+    """
+
+    def __init__(self, store, max_pending_items=DFLT_MAX_PENDING_ITEMS, max_pending_bytes=None,
+                 max_pending_seconds=None, sizeof=sys.getsizeof):
+        self.store = store
+        self.max_pending_items = max_pending_items
+        self.max_pending_bytes = max_pending_bytes
+        self.max_pending_seconds = max_pending_seconds
+        self.sizeof = sizeof
+        self._pending = {}  # key -> (val, size)
+        self._pending_bytes = 0
+        self._oldest_pending_time = None
+        self._flushing = {}  # the pending items being written (by flush), so that they're still read from the buffer
+        self._lock = RLock()
+        self._flush_lock = Lock()  # so that flushes are written in order (and deletes aren't undone by one)
+        self._flusher = None
+        self._closing = Event()
+
+    # Buffer management ###############################################################################################
+    def _should_flush(self):
+        return (len(self._pending) > self.max_pending_items
+                or (self.max_pending_bytes is not None and self._pending_bytes > self.max_pending_bytes))
+
+    def _buffer(self, k, v):  # (called with self._lock held)
+        self._unbuffer(k)
+        size = self.sizeof(v) if self.max_pending_bytes is not None else 0
+        self._pending[k] = (v, size)
+        self._pending_bytes += size
+        if self._oldest_pending_time is None:
+            self._oldest_pending_time = time.monotonic()
+        if self.max_pending_seconds is not None and self._flusher is None:
+            self._flusher = Thread(target=self._flush_when_due, daemon=True)
+            self._flusher.start()
+
+    def _unbuffer(self, k):
+        if k in self._pending:
+            _, size = self._pending.pop(k)
+            self._pending_bytes -= size
+
+    def _seconds_until_due(self):
+        with self._lock:
+            if self._oldest_pending_time is None:
+                return self.max_pending_seconds
+            return self._oldest_pending_time + self.max_pending_seconds - time.monotonic()
+
+    def _flush_when_due(self):
+        """(The background thread) Flush whenever the oldest pending write is max_pending_seconds old"""
+        while not self._closing.wait(max(self._seconds_until_due(), 0)):
+            if self._seconds_until_due() <= 0:
+                try:
+                    self.flush()
+                except Exception:  # the items are still pending: the next flush will try them (and raise) again
+                    self._closing.wait(self.max_pending_seconds)
+
+    def flush(self):
+        """Write all pending items to the store"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return
+                self._flushing, self._pending = self._pending, {}
+                self._pending_bytes = 0
+                self._oldest_pending_time = None
+            try:
+                setmany_of(self.store, [(k, v) for k, (v, _) in self._flushing.items()])
+            except BaseException:
+                with self._lock:  # keep them pending, unless they were written again meanwhile
+                    for k, (v, size) in self._flushing.items():
+                        if k not in self._pending:
+                            self._pending[k] = (v, size)
+                            self._pending_bytes += size
+                    if self._oldest_pending_time is None:
+                        self._oldest_pending_time = time.monotonic()
+                raise
+            finally:
+                with self._lock:
+                    self._flushing = {}
+
+    def close(self):
+        """Flush, and stop the background thread (if there's one)"""
+        self._closing.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    # Write ###########################################################################################################
+    def __setitem__(self, k, v):
+        with self._lock:
+            self._buffer(k, v)
+            should_flush = self._should_flush()
+        if should_flush:
+            self.flush()
+
+    def setmany(self, items):
+        with self._lock:
+            for k, v in items_of(items):
+                self._buffer(k, v)
+            should_flush = self._should_flush()
+        if should_flush:
+            self.flush()
+
+    # Read ############################################################################################################
+    def _buffered(self, k):  # (called with self._lock held)
+        if k in self._pending:
+            return self._pending[k]
+        return self._flushing.get(k)
+
+    def __getitem__(self, k):
+        with self._lock:
+            buffered = self._buffered(k)
+        if buffered is not None:
+            return buffered[0]
+        return self.store[k]
+
+    def getmany(self, keys):
+        keys = list(keys)
+        with self._lock:
+            vals = {k: buffered[0] for k, buffered in ((k, self._buffered(k)) for k in keys) if buffered is not None}
+        missing_keys = [k for k in keys if k not in vals]
+        if missing_keys:
+            vals.update(zip(missing_keys, getmany_of(self.store, missing_keys)))
+        return [vals[k] for k in keys]
+
+    def __contains__(self, k):
+        with self._lock:
+            if self._buffered(k) is not None:
+                return True
+        return k in self.store
+
+    # Explore (flushes first, so the store has everything) ############################################################
+    def __iter__(self):
+        self.flush()
+        return iter(self.store)
+
+    def __len__(self):
+        self.flush()
+        return len(self.store)
+
+    # Delete ##########################################################################################################
+    def __delitem__(self, k):
+        with self._flush_lock:  # (so that a flush in progress can't write k back after it's deleted)
+            with self._lock:
+                was_pending = k in self._pending
+                self._unbuffer(k)
+            if not was_pending:
+                del self.store[k]
+            elif k in self.store:
+                del self.store[k]
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.store!r}, max_pending_items={self.max_pending_items})"
@@ -0,0 +1,143 @@
+"""
+Compression of store values.
+
+CompressionValWrap is a val wrap (it has _data_of_obj and _obj_of_data methods) that compresses bytes with one of
+the standard library's codecs (zlib, bz2 or lzma). Every value it writes starts with a small header saying how it was
+compressed (if at all), so a store can hold values written with different codecs (or settings), and still read them
+all correctly.
+
+Since it works on bytes, it's meant to be composed with a serializing val wrap (e.g. PickleValWrap), or used on its
+own with stores of bytes. See add_compression.
+
+>>> import pickle
+>>> from py2misc.py2store.simple import DictPickleStore
+>>> s = add_compression(DictPickleStore(), codec='zlib', min_size=100)
+>>> s['small'] = 'not worth compressing'
+>>> s['big'] = 'worth compressing ' * 1000
+>>> s['small'], len(s['big'])
+('not worth compressing', 18000)
+>>> len(s.persister['small']) - len(pickle.dumps('not worth compressing'))  # stored raw, with a 5 byte header
+5
+>>> len(s.persister['big']) < 1000
+True
+"""
+
+import bz2
+import lzma
+import time
+import zlib
+
+COMPRESSION_MAGIC = b'\x89PZC'
+
+# codec name -> (id (written in the header), compress(data, level), decompress(data))
+codecs = {
+    'raw': (0, lambda data, level: data, lambda data: data),
+    'zlib': (1, lambda data, level: zlib.compress(data, -1 if level is None else level), zlib.decompress),
+    'bz2': (2, lambda data, level: bz2.compress(data, 9 if level is None else level), bz2.decompress),
+    'lzma': (3, lambda data, level: lzma.compress(data, preset=level), lzma.decompress),
+}
+codec_name_of_id = {codec_id: name for name, (codec_id, *_) in codecs.items()}
+
+DFLT_MIN_SIZE = 512  # below this size (in bytes), values are stored raw
+DFLT_N_SAMPLES = 20  # number of values to sample before choosing a codec, in auto mode
+DFLT_MAX_RATIO = 0.9  # in auto mode, compression has to do better than this, or values are stored raw
+DFLT_MIN_MB_PER_S = 20  # in auto mode, codecs that compress slower than this are only chosen if all are
+
+
+class CompressionValWrap:
+    """A val wrap that compresses (bytes) data with codec ('zlib', 'bz2' or 'lzma'), at the given level
+    (the codec's default if None). Values smaller than min_size bytes are stored raw (but still with a header).
+
+    With codec='auto', the first n_samples values (at least min_size big) are compressed with all codecs, and the
+    one with the best compression ratio among those that compress at least min_mb_per_s megabytes per second (or the
+    fastest, if none do) is chosen for all subsequent values. If even that codec doesn't compress values to less than
+    max_ratio of their size, values are stored raw. Until then, each sample is stored with its best codec.
+    The chosen codec is in the codec attribute, and the sampling measures in the samples attribute.
+
+    >>> val_wrap = CompressionValWrap(codec='auto', n_samples=3, min_size=10)
+    >>> for i in range(3):
+    ...     _ = val_wrap._data_of_obj(b'very compressible ' * 100)
+    >>> val_wrap.codec in {'zlib', 'bz2', 'lzma'}
+    True
+    >>> val_wrap._obj_of_data(val_wrap._data_of_obj(b'hello world')) == b'hello world'
+    True
+    """
+
+    def __init__(self, codec='zlib', level=None, min_size=DFLT_MIN_SIZE, n_samples=DFLT_N_SAMPLES,
+                 max_ratio=DFLT_MAX_RATIO, min_mb_per_s=DFLT_MIN_MB_PER_S):
+        assert codec == 'auto' or codec in codecs, f"Unknown codec ({codec}). Must be 'auto' or in {list(codecs)}"
+        self.codec = codec
+        self.level = level
+        self.min_size = min_size
+        self.n_samples = n_samples
+        self.max_ratio = max_ratio
+        self.min_mb_per_s = min_mb_per_s
+        self.samples = {name: {'n_bytes': 0, 'n_compressed_bytes': 0, 'seconds': 0.0}
+                        for name in codecs if name != 'raw'}
+        self._n_sampled = 0
+
+    def _compress(self, data, codec):
+        codec_id, compress, _ = codecs[codec]
+        return COMPRESSION_MAGIC + bytes([codec_id]) + compress(data, self.level)
+
+    def _sample(self, data):
+        """Compress data with all codecs, update the samples, and return the smallest compression"""
+        best = None
+        for name, sample in self.samples.items():
+            tic = time.perf_counter()
+            compressed = self._compress(data, name)
+            sample['seconds'] += time.perf_counter() - tic
+            sample['n_bytes'] += len(data)
+            sample['n_compressed_bytes'] += len(compressed)
+            if best is None or len(compressed) < len(best):
+                best = compressed
+        self._n_sampled += 1
+        if self._n_sampled >= self.n_samples:
+            self.codec = self._choose_codec()
+        return best
+
+    def _choose_codec(self):
+        def ratio(name):
+            return self.samples[name]['n_compressed_bytes'] / self.samples[name]['n_bytes']
+
+        def mb_per_s(name):
+            return self.samples[name]['n_bytes'] / 1e6 / max(self.samples[name]['seconds'], 1e-9)
+
+        fast_enough = [name for name in self.samples if mb_per_s(name) >= self.min_mb_per_s]
+        if fast_enough:
+            best = min(fast_enough, key=ratio)
+        else:
+            best = max(self.samples, key=mb_per_s)
+        return best if ratio(best) < self.max_ratio else 'raw'
+
+    def _data_of_obj(self, v):
+        if len(v) < self.min_size:
+            return self._compress(v, 'raw')
+        if self.codec == 'auto':
+            return self._sample(v)
+        return self._compress(v, self.codec)
+
+    def _obj_of_data(self, data):
+        if data[:len(COMPRESSION_MAGIC)] != COMPRESSION_MAGIC:
+            return data  # not written by a CompressionValWrap: return as is
+        _, _, decompress = codecs[codec_name_of_id[data[len(COMPRESSION_MAGIC)]]]
+        return decompress(data[len(COMPRESSION_MAGIC) + 1:])
+
+
+def add_compression(store, codec='zlib', level=None, min_size=DFLT_MIN_SIZE, **auto_kwargs):
+    """Make store compress its data (after its own _data_of_obj), and decompress it (before its own _obj_of_data).
+    Works with any store whose value transforms are _data_of_obj and _obj_of_data (instance or class) attributes
+    (e.g. py2store.simple.Store and py2store.kv.Store). Returns the (modified) store.
+    """
+    val_wrap = CompressionValWrap(codec=codec, level=level, min_size=min_size, **auto_kwargs)
+    data_of_obj, obj_of_data = store._data_of_obj, store._obj_of_data
+
+    def _data_of_obj(obj):
+        return val_wrap._data_of_obj(data_of_obj(obj))
+
+    def _obj_of_data(data):
+        return obj_of_data(val_wrap._obj_of_data(data))
+
+    store._data_of_obj, store._obj_of_data = _data_of_obj, _obj_of_data
+    store.compression = val_wrap
+    return store
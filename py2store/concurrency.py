@@ -0,0 +1,56 @@
+"""
+Concurrent maps, over thread (or process) pools, that only consume their input as needed (see imap_ordered), and
+other iteration helpers.
+"""
+
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait
+
+DFLT_MAX_WORKERS = 8
+
+
+def imap_ordered(func, iterable, executor, n_ahead=DFLT_MAX_WORKERS):
+    """Like executor.map(func, iterable), but only consumes iterable as needed, to keep at most n_ahead calls
+    submitted (running or done, but not yet yielded) at any time. Results are yielded in the order of iterable."""
+    futures = deque()
+    try:
+        for x in iterable:
+            futures.append(executor.submit(func, x))
+            if len(futures) >= n_ahead:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
+    finally:  # if the consumer stops early (or an error is raised), don't do the work that won't be used
+        for future in futures:
+            future.cancel()
+
+
+def imap_unordered(func, iterable, executor, n_ahead=DFLT_MAX_WORKERS):
+    """Like imap_ordered, but yielding results as they're done (so a slow call doesn't hold back the others)"""
+    pending = set()
+    try:
+        for x in iterable:
+            pending.add(executor.submit(func, x))
+            if len(pending) >= n_ahead:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def chunks(iterable, chunk_size):
+    """Yield the items of iterable in lists of chunk_size items (the last one can be shorter)"""
+    chunk = []
+    for x in iterable:
+        chunk.append(x)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
@@ -0,0 +1,205 @@
+"""
+Bulk copy (and sync) of the contents of a store to another: concurrent, incremental, and resumable.
+
+copy_store(src, dst) copies the items of src to dst (any two stores, or MutableMappings: from a SimpleFileStore to an
+S3Store, between two prefixes of a bucket...). Keys are listed as the copy goes (never all at once), and values are
+copied by a pool of threads, so that the copy is limited by throughput, not by the latency of each read and write.
+
+Keys whose data is already in dst are skipped: By default, those whose stored data has the same metadata in both
+stores (see Store.meta and metas_match). So copying again only copies what's new or changed, as rsync does.
+
+With a checkpoint file, the keys that are done are recorded as the copy goes, so that a copy that was interrupted
+(a crash, a ctrl-C, a lost connection...) resumes where it left off, without checking those keys again. The checkpoint
+is deleted once all keys are copied.
+
+>>> src = {'a': b'alpha', 'b': b'beta', 'c': b'gamma'}
+>>> dst = {'a': b'alpha'}
+>>> report = copy_store(src, dst, workers=2, skip='exists')
+>>> dst == src
+True
+>>> report['n_copied'], report['n_skipped'], report['bytes']
+(2, 1, 9)
+"""
+
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from py2misc.py2store.metrics import nbytes
+from py2misc.py2store.concurrency import imap_unordered
+
+DFLT_COPY_WORKERS = 16
+DFLT_COPY_CHUNKSIZE = 1024 * 1024  # bytes read (and written) at a time by raw copies
+DFLT_CHECKPOINT_EVERY = 5  # seconds between flushes of the checkpoint (and calls to progress)
+SKIP_POLICIES = ('meta', 'exists', None)
+
+
+def meta_of(store, k):
+    """The metadata of k in store (see Store.meta), or None if the store doesn't have any (or doesn't have k)"""
+    meta = getattr(store, 'meta', None)
+    if meta is None:
+        return None
+    try:
+        return meta(k)
+    except KeyError:
+        return None
+
+
+def metas_match(src_meta, dst_meta):
+    """Whether the metadata of a key in the source and destination stores say its data is the same: Same size, and
+    the same etag if both have one, or else a destination mtime that's not older than the source's."""
+    if src_meta is None or dst_meta is None or src_meta.get('size') != dst_meta.get('size'):
+        return False
+    if src_meta.get('etag') is not None and dst_meta.get('etag') is not None:
+        return src_meta['etag'] == dst_meta['etag']
+    if src_meta.get('mtime') is not None and dst_meta.get('mtime') is not None:
+        return dst_meta['mtime'] >= src_meta['mtime']
+    return True
+
+
+# Checkpoints: A json line per key that is done ######################################################################
+def _key_of_json(k):
+    return tuple(k) if isinstance(k, list) else k  # (json makes tuple keys lists)
+
+
+def read_checkpoint(filepath):
+    """The set of keys recorded as done in the checkpoint file (empty if there's no such file)"""
+    if not os.path.isfile(filepath):
+        return set()
+    done = set()
+    with open(filepath) as fp:
+        for line in fp:
+            try:
+                done.add(_key_of_json(json.loads(line)))
+            except ValueError:  # a line that was partially written when the copy was interrupted
+                pass
+    return done
+
+
+def _open_checkpoint(filepath):
+    """The checkpoint file, open to append keys to, on a new line (an interrupted copy may have left a partial one)"""
+    fp = open(filepath, 'a+')
+    if fp.tell() > 0:
+        fp.seek(fp.tell() - 1)
+        if fp.read(1) != '\n':
+            fp.write('\n')
+    return fp
+
+
+########################################################################################################################
+def _copy_stream(src_fp, dst_fp, chunksize=DFLT_COPY_CHUNKSIZE):
+    """Copy src_fp to dst_fp, chunksize bytes at a time, and return the number of bytes copied.
+    (Counted here, since not all file-likes have a tell: S3MultipartWriter doesn't)"""
+    n_bytes = 0
+    while True:
+        chunk = src_fp.read(chunksize)
+        if not chunk:
+            return n_bytes
+        dst_fp.write(chunk)
+        n_bytes += len(chunk)
+
+
+def _copy_item(src, dst, k, skip='meta', raw=False):
+    """Copy k from src to dst (unless skip says not to). Returns a (k, status, n_bytes, error) tuple"""
+    try:
+        if skip == 'exists' and k in dst:
+            return k, 'skipped', 0, None
+        src_meta = None
+        if skip == 'meta':
+            src_meta = meta_of(src, k)
+            if src_meta is not None and metas_match(src_meta, meta_of(dst, k)):
+                return k, 'skipped', 0, None
+        if raw:
+            with src.open(k, 'rb') as src_fp, dst.open(k, 'wb') as dst_fp:
+                n_bytes = _copy_stream(src_fp, dst_fp)
+        else:
+            v = src[k]
+            dst[k] = v
+            n_bytes = nbytes(v)
+            if n_bytes is None and src_meta is not None:
+                n_bytes = src_meta.get('size')
+        return k, 'copied', n_bytes or 0, None
+    except Exception as e:
+        return k, 'failed', 0, e
+
+
+def _report(counts, failures, tic):
+    seconds = time.perf_counter() - tic
+    n_done = counts['copied'] + counts['skipped']
+    return dict(n_copied=counts['copied'], n_skipped=counts['skipped'], n_resumed=counts['resumed'],
+                n_failed=len(failures), bytes=counts['bytes'], seconds=seconds,
+                items_per_second=n_done / seconds if seconds else None,
+                bytes_per_second=counts['bytes'] / seconds if seconds else None,
+                failures=dict(failures))
+
+
+def copy_store(src, dst, workers=DFLT_COPY_WORKERS, checkpoint=None, keys=None, skip='meta', raw=False,
+               progress=None, checkpoint_every=DFLT_CHECKPOINT_EVERY):
+    """Copy the items of src (of keys only, if given) to dst, with workers threads.
+
+    skip says which keys are skipped:
+        - 'meta': those whose data has the same metadata in src and dst (see metas_match). Keys can only be skipped
+            if both stores have a meta method (the stores of py2store.simple do: only file and S3 persisters give
+            metadata though). If not, everything is copied.
+        - 'exists': those that are in dst, whatever their data.
+        - None: none of them.
+
+    checkpoint is the filepath where the keys that are done (copied or skipped) are recorded (as json, so keys must be
+    strings, numbers or tuples of them), every checkpoint_every seconds. If it exists, the keys it records are
+    skipped (and counted in n_resumed). It's deleted when the copy is over, if no key failed.
+
+    With raw=True, the data is copied as stored (it's not deserialized and serialized again), streaming it from
+    src.open(k, 'rb') to dst.open(k, 'wb'), so that big values are never held in memory.
+
+    A key that fails to copy doesn't stop the copy: Its error is reported in the failures, and it's not checkpointed,
+    so it's attempted again when the copy is resumed.
+    An interruption (KeyboardInterrupt...) does stop it, after the checkpoint is flushed.
+
+    Returns a report: the numbers of keys copied, skipped, resumed and failed, the bytes copied (of bytes and string
+    values, or as given by src's metadata), the seconds taken, and the throughput in items (copied or skipped) and
+    bytes per second. If progress is given, it's called with the report (so far) every checkpoint_every seconds.
+    """
+    assert skip in SKIP_POLICIES, f"skip ({skip}) not valid: Must be in {SKIP_POLICIES}"
+    tic = time.perf_counter()
+    counts = dict(copied=0, skipped=0, resumed=0, bytes=0)
+    failures = {}
+    done = read_checkpoint(checkpoint) if checkpoint is not None else set()
+    keys = iter(src) if keys is None else keys
+
+    def keys_to_copy():
+        for k in keys:
+            if k in done:
+                counts['resumed'] += 1
+            else:
+                yield k
+
+    checkpoint_fp = _open_checkpoint(checkpoint) if checkpoint is not None else None
+    last_flush = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(workers) as executor:
+            copy_item = partial(_copy_item, src, dst, skip=skip, raw=raw)
+            for k, status, n_bytes, error in imap_unordered(copy_item, keys_to_copy(), executor, n_ahead=2 * workers):
+                if status == 'failed':
+                    failures[k] = repr(error)
+                    continue
+                counts[status] += 1
+                counts['bytes'] += n_bytes
+                if checkpoint_fp is not None:
+                    checkpoint_fp.write(json.dumps(k) + '\n')
+                if time.perf_counter() - last_flush >= checkpoint_every:
+                    if checkpoint_fp is not None:
+                        checkpoint_fp.flush()
+                    if progress is not None:
+                        progress(_report(counts, failures, tic))
+                    last_flush = time.perf_counter()
+    finally:
+        if checkpoint_fp is not None:
+            checkpoint_fp.close()
+    if checkpoint is not None and not failures:
+        os.remove(checkpoint)
+    report = _report(counts, failures, tic)
+    if progress is not None:
+        progress(report)
+    return report
@@ -0,0 +1,142 @@
+"""
+Content-addressed deduplication of store values.
+
+When many keys hold the same data (repeated snapshots, re-uploaded files...), a store that writes each copy
+separately wastes space (and write time). DedupPersister writes every distinct data once, under its hash (digest),
+and only keeps a key -> digest mapping for the keys.
+"""
+
+import hashlib
+from collections import Counter
+from threading import RLock
+
+from py2misc.py2store.simple import Persister
+
+DFLT_HASH_NAME = 'sha256'
+
+
+class DedupPersister(Persister):
+    """A persister that stores each distinct (bytes) data only once.
+
+    The data is written in blobs (any persister), under its hexdigest (with hash_name, any hashlib algorithm),
+    and the digest of each key is written in refs (any persister). Writing data that's already there only costs the
+    hash and the (small) write of the digest in refs.
+
+    The number of keys that reference each digest is kept in counts (any MutableMapping: If None, a dict that is
+    computed from refs when it's first needed). When a key is deleted or overwritten, the count of its old digest is
+    decremented, and the blob deleted if it's not referenced anymore.
+    If refs, blobs or counts are written to by other means (or a crash left them inconsistent), gc() recounts the
+    references and deletes the blobs that aren't referenced.
+
+    Only one DedupPersister (in one process) may write to a given refs and blobs: The counts are read, changed and
+    written back without any lock shared with other instances (even if they're persisted, by giving a persister as
+    counts), so concurrent writers would lose count updates, and delete blobs that the other just referenced.
+    Any number of instances (and processes) can read them. Writes of this instance are thread safe.
+
+    Use it as the persister of a Store to serialize objects, e.g. Store(DedupPersister(...), _data_of_obj=...).
+
+    >>> blobs, refs = dict(), dict()
+    >>> s = DedupPersister(blobs, refs)
+    >>> s['monday'] = b'the same old config'
+    >>> s['tuesday'] = b'the same old config'
+    >>> s['wednesday'] = b'a new config'
+    >>> len(s), len(blobs)  # three keys, but only two blobs
+    (3, 2)
+    >>> del s['monday']
+    >>> len(blobs)  # still referenced by tuesday, so not deleted
+    2
+    >>> s['tuesday'] = b'a new config'
+    >>> len(blobs)  # the first config isn't referenced anymore
+    1
+    >>> blobs['orphan'] = b'written behind our back'
+    >>> s.gc()
+    1
+    >>> list(s), list(blobs.values())
+    (['tuesday', 'wednesday'], [b'a new config'])
+    """
+
+    def __init__(self, blobs, refs, counts=None, hash_name=DFLT_HASH_NAME):
+        self.blobs = blobs
+        self.refs = refs
+        self.hash_name = hash_name
+        self._counts = counts
+        self._lock = RLock()
+
+    def digest(self, data):
+        return hashlib.new(self.hash_name, data).hexdigest()
+
+    @property
+    def counts(self):
+        if self._counts is None:
+            self._counts = dict(Counter(self.refs[k] for k in self.refs))
+        return self._counts
+
+    def _incref(self, digest, data):
+        counts = self.counts
+        n_refs = counts.get(digest, 0)
+        if n_refs == 0:
+            self.blobs[digest] = data
+        counts[digest] = n_refs + 1
+
+    def _decref(self, digest):
+        counts = self.counts
+        n_refs = counts.get(digest, 0) - 1
+        if n_refs > 0:
+            counts[digest] = n_refs
+        else:
+            counts.pop(digest, None)
+            if digest in self.blobs:
+                del self.blobs[digest]
+
+    def _ref_of(self, k):
+        if k in self.refs:  # (not try/except KeyError, since not all persisters raise KeyError on missing keys)
+            return self.refs[k]
+
+    def __setitem__(self, k, v):
+        digest = self.digest(v)
+        with self._lock:
+            old_digest = self._ref_of(k)
+            if old_digest == digest:
+                return  # same data: nothing to do
+            self._incref(digest, v)  # write the blob before the reference to it...
+            self.refs[k] = digest
+            if old_digest is not None:
+                self._decref(old_digest)  # ... and only then let go of the old one
+
+    def __getitem__(self, k):
+        return self.blobs[self.refs[k]]
+
+    def __delitem__(self, k):
+        with self._lock:
+            digest = self.refs[k]
+            del self.refs[k]
+            self._decref(digest)
+
+    def __iter__(self):
+        return iter(self.refs)
+
+    def __len__(self):
+        return len(self.refs)
+
+    def __contains__(self, k):
+        return k in self.refs
+
+    def gc(self):
+        """Recount the references to blobs, and delete the blobs that aren't referenced.
+        Returns the number of blobs deleted."""
+        with self._lock:
+            counts = Counter(self.refs[k] for k in self.refs)
+            orphans = [digest for digest in self.blobs if digest not in counts]
+            for digest in orphans:
+                del self.blobs[digest]
+            if self._counts is None:
+                self._counts = {}
+            else:
+                for digest in list(self._counts):
+                    if digest not in counts:
+                        del self._counts[digest]
+            self._counts.update(counts)
+            return len(orphans)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(blobs={self.blobs!r}, refs={self.refs!r})"
@@ -0,0 +1,128 @@
+"""
+Durable file writes: fsyncs of files and directories, and group commits, that share the cost of the fsyncs of
+concurrent writes (see GroupCommitter).
+"""
+
+import os
+import uuid
+from contextlib import contextmanager
+from threading import Condition
+
+DFLT_GROUP_COMMIT_WINDOW = 0.002  # seconds a group commit waits for other writes to join it
+
+
+def fsync_path(path):
+    """fsync a file or (on posix) a directory, given its path"""
+    if os.name != 'posix' and os.path.isdir(path):
+        return  # can't open (therefore fsync) a directory on windows
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def tmp_filepath_for(filepath):
+    """A (hidden, unique) temporary filepath in the same directory as filepath, to write to before renaming"""
+    dirpath, filename = os.path.split(filepath)
+    return os.path.join(dirpath, f".{filename}.{uuid.uuid4().hex}.tmp")
+
+
+class GroupCommitError(OSError):
+    """Raised in the writers of a group whose commit failed (in the thread that led it). Its __cause__ is the error"""
+
+
+class GroupCommitter:
+    """Makes file writes durable in groups, to share the cost of the fsyncs between all the writes of a group.
+
+    commit(tmp_filepath, filepath) blocks until tmp_filepath has been fsynced, renamed to filepath, and the directory
+    of filepath fsynced. The first writer to arrive leads a group: It waits (at most window seconds) for the other
+    writes in flight (those made in a writing() context) to join, then commits them all with one fsync per file and
+    one per directory. So a lone writer (e.g. a loop of store[k] = v) doesn't wait at all.
+    The writes arriving while a group is being committed will be committed in the next group.
+    If a group's commit fails, its leader raises the error, and the other writers of the group a GroupCommitError
+    (of their own) caused by it.
+    """
+
+    def __init__(self, window=DFLT_GROUP_COMMIT_WINDOW):
+        self.window = window
+        self._cond = Condition()
+        self._pending = []  # (tmp_filepath, filepath) pairs of the group being formed
+        self._next_group = 0  # the group that new writes join
+        self._n_committed_groups = 0
+        self._committing = False
+        self._errors = {}  # group -> [the exception that its commit raised, number of writers yet to raise it]
+        self._n_writing = 0  # number of writes in flight (in a writing() context)
+
+    @contextmanager
+    def writing(self):
+        """The context of a write (to be committed in it): The leader of a group waits for the writes in flight"""
+        with self._cond:
+            self._n_writing += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._n_writing -= 1
+                self._cond.notify_all()
+
+    def _all_writes_joined(self):
+        return self._n_writing <= len(self._pending)
+
+    def commit(self, tmp_filepath, filepath):
+        with self._cond:
+            self._pending.append((tmp_filepath, filepath))
+            self._cond.notify_all()  # (a leader may be waiting for this write to join)
+            group = self._next_group
+            while self._n_committed_groups <= group:
+                if not self._committing:
+                    self._committing = True
+                    break  # no one is committing: lead the group
+                self._cond.wait()
+            else:  # the group was committed by another writer
+                error = self._group_error(group)
+                if error is not None:
+                    raise GroupCommitError(f"The commit of {filepath} failed: {error!r}") from error
+                return
+        self._lead_commit()
+
+    def _group_error(self, group):
+        """The error of the commit of group, if it failed (forgotten once all its followers got it)"""
+        if group not in self._errors:
+            return None
+        error_and_count = self._errors[group]
+        error_and_count[1] -= 1
+        if error_and_count[1] == 0:
+            del self._errors[group]
+        return error_and_count[0]
+
+    def _lead_commit(self):
+        error = None
+        batch, group = [], self._next_group
+        try:
+            with self._cond:
+                if self.window:  # let the other writes in flight join the group
+                    self._cond.wait_for(self._all_writes_joined, timeout=self.window)
+                batch, self._pending = self._pending, []
+                group = self._next_group
+                self._next_group += 1
+            self._commit_batch(batch)
+        except Exception as e:
+            error = e
+        with self._cond:
+            if error is not None and len(batch) > 1:  # (the leader's write is in the batch too)
+                self._errors[group] = [error, len(batch) - 1]
+            self._n_committed_groups = group + 1
+            self._committing = False
+            self._cond.notify_all()
+        if error is not None:
+            raise error
+
+    @staticmethod
+    def _commit_batch(batch):
+        for tmp_filepath, _ in batch:
+            fsync_path(tmp_filepath)
+        for tmp_filepath, filepath in batch:
+            os.replace(tmp_filepath, filepath)
+        for dirpath in {os.path.dirname(filepath) for _, filepath in batch}:
+            fsync_path(dirpath)
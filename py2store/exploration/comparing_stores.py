@@ -335,3 +335,163 @@ class StoreLessDunders(Persister):
     # Misc ####################################################################
     def __repr__(self):
         return repr(self.store)
+
+
+########################################################################################################################
+# Benchmarks
+# A (reproducible) measure of the overhead of the store layers, for the basic operations.
+# Run as a script to get the results as json, e.g.:
+#     python -m py2misc.py2store.exploration.comparing_stores --key_counts 100 10000 --output store_benchmarks.json
+# Each result is the best (minimum) time of repeat runs, of an operation done on all n_keys keys of a store (len is
+# called n_ops times: min(n_keys, MAX_LEN_CALLS), since it walks all files of file stores), and also given per
+# operation (ns_per_op), and relative to the same operation on a plain dict (vs_dict).
+
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+DFLT_KEY_COUNTS = (100, 1000, 10000)
+DFLT_VALUE_SIZES = (16, 1024, 65536)
+DFLT_REPEAT = 5
+DFLT_MAX_FILE_BYTES = 100 * 1024 ** 2  # file stores are skipped when n_keys * value_size is more than this
+BENCHMARK_OPERATIONS = ('set', 'get', 'contains', 'iter', 'len')
+MAX_LEN_CALLS = 100
+
+
+class StoreWithTransforms(Store):
+    """A Store with (cheap, but non trivial) key and value transforms"""
+
+    def _id_of_key(self, k):
+        return '/root/' + k
+
+    def _key_of_id(self, _id):
+        return _id[6:]
+
+    def _data_of_obj(self, obj):
+        return (len(obj), obj)
+
+    def _obj_of_data(self, data):
+        return data[1]
+
+
+def _simple_store(name, rootdir):
+    from py2misc.py2store import simple
+    if name == 'DictPickleStore':
+        return simple.DictPickleStore()
+    elif name == 'SimpleFileStore':
+        return simple.SimpleFileStore(rootdir, mode='b')
+    elif name == 'PickleFileStore':
+        return simple.PickleFileStore(rootdir)
+
+
+# name -> function(rootdir) making an empty store (rootdir is an empty directory, for the stores that need one)
+store_factories = {
+    'dict': lambda rootdir: dict(),
+    'Store(identity)': lambda rootdir: Store(dict()),
+    'Store(transforms)': lambda rootdir: StoreWithTransforms(dict()),
+    'StoreLessDunders': lambda rootdir: StoreLessDunders(dict()),
+    'DictPickleStore': lambda rootdir: _simple_store('DictPickleStore', rootdir),
+    'SimpleFileStore': lambda rootdir: _simple_store('SimpleFileStore', rootdir),
+    'PickleFileStore': lambda rootdir: _simple_store('PickleFileStore', rootdir),
+}
+file_store_names = {'SimpleFileStore', 'PickleFileStore'}
+
+
+def _n_ops(op, n_keys):
+    """The number of times op is done in a run over n_keys keys"""
+    return min(n_keys, MAX_LEN_CALLS) if op == 'len' else n_keys
+
+
+def _time_operations(store, keys, val):
+    def set_all():
+        for k in keys:
+            store[k] = val
+
+    def get_all():
+        for k in keys:
+            store[k]
+
+    def contains_all():
+        for k in keys:
+            k in store
+
+    def iter_all():
+        for _ in store:
+            pass
+
+    def len_all():
+        for _ in range(_n_ops('len', len(keys))):
+            len(store)
+
+    seconds = {}
+    for op, func in zip(BENCHMARK_OPERATIONS, (set_all, get_all, contains_all, iter_all, len_all)):
+        tic = time.perf_counter()
+        func()
+        seconds[op] = time.perf_counter() - tic
+    return seconds
+
+
+def benchmark_store(name, n_keys, value_size, repeat=DFLT_REPEAT):
+    """The best of repeat timings (in seconds) of each operation, done over n_keys keys (with values of value_size
+    bytes) on a fresh store made by store_factories[name]"""
+    keys = [f'k{i:08d}' for i in range(n_keys)]
+    val = os.urandom(value_size)
+    best = {}
+    for _ in range(repeat):
+        rootdir = tempfile.mkdtemp(prefix='py2store_benchmark_')
+        try:
+            seconds = _time_operations(store_factories[name](rootdir), keys, val)
+        finally:
+            shutil.rmtree(rootdir, ignore_errors=True)
+        for op, secs in seconds.items():
+            best[op] = min(secs, best.get(op, secs))
+    return best
+
+
+def benchmark_stores(stores=tuple(store_factories), key_counts=DFLT_KEY_COUNTS, value_sizes=DFLT_VALUE_SIZES,
+                     repeat=DFLT_REPEAT, max_file_bytes=DFLT_MAX_FILE_BYTES):
+    """Benchmark the stores (names of store_factories) for all key_counts and value_sizes, and return the results
+    (with some info on the environment) as a json-serializable dict"""
+    results = []
+    for n_keys in key_counts:
+        for value_size in value_sizes:
+            dict_seconds = benchmark_store('dict', n_keys, value_size, repeat)
+            for name in stores:
+                if name in file_store_names and n_keys * value_size > max_file_bytes:
+                    continue
+                seconds = dict_seconds if name == 'dict' else benchmark_store(name, n_keys, value_size, repeat)
+                for op, secs in seconds.items():
+                    n_ops = _n_ops(op, n_keys)
+                    results.append(dict(store=name, n_keys=n_keys, value_size=value_size, operation=op,
+                                        n_ops=n_ops, seconds=secs, ns_per_op=1e9 * secs / n_ops,
+                                        vs_dict=secs / dict_seconds[op] if dict_seconds[op] else None))
+    return dict(
+        environment=dict(python=sys.version, implementation=platform.python_implementation(),
+                         platform=platform.platform(), time=time.strftime('%Y-%m-%dT%H:%M:%S%z')),
+        parameters=dict(stores=list(stores), key_counts=list(key_counts), value_sizes=list(value_sizes),
+                        repeat=repeat, max_file_bytes=max_file_bytes),
+        results=results,
+    )
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark the overhead of store layers (results as json)')
+    parser.add_argument('--stores', nargs='+', default=list(store_factories), choices=list(store_factories))
+    parser.add_argument('--key_counts', nargs='+', type=int, default=list(DFLT_KEY_COUNTS))
+    parser.add_argument('--value_sizes', nargs='+', type=int, default=list(DFLT_VALUE_SIZES))
+    parser.add_argument('--repeat', type=int, default=DFLT_REPEAT)
+    parser.add_argument('--max_file_bytes', type=int, default=DFLT_MAX_FILE_BYTES)
+    parser.add_argument('--output', default=None, help='The json file to write to (stdout if not given)')
+    args = parser.parse_args()
+    benchmarks = benchmark_stores(args.stores, args.key_counts, args.value_sizes, args.repeat, args.max_file_bytes)
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(benchmarks, fp, indent=2)
+    else:
+        print(json.dumps(benchmarks, indent=2))
@@ -0,0 +1,88 @@
+"""
+Throughput of S3Store reads and writes, sequential (one request at a time) versus concurrent (bulk operations, done
+in S3Store's thread pool).
+
+Meant to be run against a local S3-compatible server, so it can be run offline, and without costs. For example:
+    pip install "moto[server]" && moto_server -p 5000
+    python -m py2misc.py2store.exploration.s3_throughput --endpoint_url http://127.0.0.1:5000
+(minio works too: give its credentials with --aws_access_key_id and --aws_secret_access_key).
+
+Prints the measures as json: seconds and items per second, for each (operation, method) pair.
+"""
+
+import json
+import time
+import uuid
+
+from py2misc.py2store.simple import S3Store, get_s3_resource, DFLT_S3_MAX_WORKERS
+
+DFLT_ENDPOINT_URL = 'http://127.0.0.1:5000'
+
+
+def _timed(func, *args):
+    tic = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - tic
+
+
+def s3_throughput(endpoint_url=DFLT_ENDPOINT_URL,
+                  bucket_name=None,
+                  n_items=200,
+                  item_size=10_000,
+                  max_workers=DFLT_S3_MAX_WORKERS,
+                  aws_access_key_id='testing',
+                  aws_secret_access_key='testing'):
+    """Write and read n_items values of item_size bytes, sequentially and concurrently, and return the measures.
+    If bucket_name is None, a (uniquely named) bucket is made for the occasion (and deleted at the end)."""
+    s3_resource = get_s3_resource(aws_access_key_id, aws_secret_access_key, endpoint_url=endpoint_url,
+                                  max_pool_connections=max_workers)
+    make_bucket = bucket_name is None
+    if make_bucket:
+        bucket_name = f'py2store-throughput-{uuid.uuid4().hex[:12]}'
+        s3_resource.create_bucket(Bucket=bucket_name)
+    s = S3Store.from_s3_resource(bucket_name, s3_resource, _prefix='throughput/',
+                                 _obj_of_data=lambda x: x, max_workers=max_workers)
+    val = b'x' * item_size
+    seq_items = [(f'seq/{i}', val) for i in range(n_items)]
+    con_items = [(f'con/{i}', val) for i in range(n_items)]
+
+    def write_sequentially():
+        for k, v in seq_items:
+            s[k] = v
+
+    def read_sequentially():
+        for k, _ in seq_items:
+            s[k]
+
+    seconds = {
+        ('write', 'sequential'): _timed(write_sequentially),
+        ('write', 'concurrent'): _timed(s.setmany, con_items),
+        ('read', 'sequential'): _timed(read_sequentially),
+        ('read', 'concurrent'): _timed(s.getmany, [k for k, _ in con_items]),
+        ('items', 'concurrent'): _timed(lambda: list(s.items())),
+    }
+    s.delmany([k for k, _ in seq_items + con_items])
+    s.close()
+    if make_bucket:
+        s3_resource.Bucket(bucket_name).delete()
+
+    n_items_of = {'items': 2 * n_items}
+    return dict(
+        endpoint_url=endpoint_url, n_items=n_items, item_size=item_size, max_workers=max_workers,
+        measures=[dict(operation=op, method=method, seconds=secs, items_per_second=n_items_of.get(op, n_items) / secs)
+                  for (op, method), secs in seconds.items()]
+    )
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--endpoint_url', default=DFLT_ENDPOINT_URL)
+    parser.add_argument('--bucket_name', default=None)
+    parser.add_argument('--n_items', type=int, default=200)
+    parser.add_argument('--item_size', type=int, default=10_000)
+    parser.add_argument('--max_workers', type=int, default=DFLT_S3_MAX_WORKERS)
+    parser.add_argument('--aws_access_key_id', default='testing')
+    parser.add_argument('--aws_secret_access_key', default='testing')
+    print(json.dumps(s3_throughput(**vars(parser.parse_args())), indent=2))
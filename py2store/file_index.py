@@ -0,0 +1,184 @@
+"""
+An index of the files of a SimpleFilePersister, kept in a sidecar file, so that listing its keys doesn't walk the
+whole directory tree every time (see IndexedSimpleFilePersister).
+"""
+
+import json
+import os
+import tempfile
+
+from py2misc.py2store.simple import SimpleFilePersister, ensure_slash_suffix, file_sep, items_of, scan_dir
+
+DFLT_KEY_INDEX_FILENAME = '.py2store_key_index.json'  # hidden, so it's not listed as a key
+DFLT_INDEX_SAVE_THRESHOLD = 100  # changes to the index (files added or removed, directories re-listed) before a save
+
+
+def _n_index_entry_changes(old_entry, new_entry):
+    """The number of names (of files and subdirectories) added or removed from a directory's index entry
+    (from or to None, if the directory is new, or was removed), plus one for a new or removed directory"""
+    if old_entry is None or new_entry is None:
+        entry = new_entry or old_entry
+        return len(entry[1]) + len(entry[2]) + 1
+    return len(old_entry[1] ^ new_entry[1]) + len(old_entry[2] ^ new_entry[2])
+
+
+class IndexedSimpleFilePersister(SimpleFilePersister):
+    """A SimpleFilePersister that lists its keys from an index instead of walking the whole rootdir every time.
+
+    The index holds the (modification time, filenames, subdirectory names) of every directory under rootdir.
+    It is kept up to date by the writes and deletes made through the persister, and refreshed (by refresh_index,
+    which __iter__ and __len__ call) by statting every directory and only re-listing those whose modification time
+    changed. This catches the files that were added or removed by other means (a directory's mtime changes when an
+    entry is added to, or removed from it). Between refreshes, __contains__ answers from the index only.
+
+    The index is saved in a (hidden) sidecar file under rootdir, so that other instances (and processes) start from
+    it instead of walking the whole tree. A save rewrites the whole index (a JSON of all the filenames), so it's only
+    made by a refresh (of a __iter__ or __len__), once there are save_threshold changes that weren't saved.
+    A saved index that is missing the latest changes is still correct: The directories that changed since it was
+    saved have another mtime, so they're re-listed by the refresh of the instance that loads it.
+    """
+
+    def __init__(self, rootdir, mode='t', fsync_policy='none', index_filename=DFLT_KEY_INDEX_FILENAME,
+                 save_threshold=DFLT_INDEX_SAVE_THRESHOLD):
+        super().__init__(rootdir, mode, fsync_policy)
+        self.index_filepath = os.path.join(self.rootdir, index_filename)
+        self.save_threshold = save_threshold
+        self._dirs = None  # dirpath -> (mtime_ns, filenames, subdirnames). Loaded at first use.
+        self._n_unsaved_changes = 0
+
+    # Index management ################################################################################################
+    def _load_index(self):
+        self._dirs = {}
+        try:
+            with open(self.index_filepath) as fp:
+                rel_dirs = json.load(fp)
+        except (OSError, ValueError):  # no index (or a corrupted one): It will be built by the refresh
+            return
+        for rel_dirpath, (mtime, filenames, subdirnames) in rel_dirs.items():
+            self._dirs[self.rootdir + rel_dirpath] = (mtime, set(filenames), set(subdirnames))
+
+    def save_index(self):
+        """Save the index to the sidecar file"""
+        rootdir_length = len(self.rootdir)
+        rel_dirs = {dirpath[rootdir_length:]: (mtime, sorted(filenames), sorted(subdirnames))
+                    for dirpath, (mtime, filenames, subdirnames) in self._dirs.items()}
+        dirpath, filename = os.path.split(self.index_filepath)
+        fd, tmp_filepath = tempfile.mkstemp(suffix='.tmp', prefix=f'.{filename}.', dir=dirpath)  # (unique, hidden)
+        try:
+            with os.fdopen(fd, 'w') as fp:
+                json.dump(rel_dirs, fp)
+            os.replace(tmp_filepath, self.index_filepath)
+        except BaseException:
+            if os.path.exists(tmp_filepath):
+                os.remove(tmp_filepath)
+            raise
+        self._n_unsaved_changes = 0
+
+    def refresh_index(self):
+        """Re-list the directories that changed since they were last listed (and save the index if there are
+        save_threshold unsaved changes)"""
+        if self._dirs is None:
+            self._load_index()
+        old_dirs, new_dirs = self._dirs, {}
+        n_changes = 0
+        dirpaths = [self.rootdir]
+        while dirpaths:
+            dirpath = dirpaths.pop()
+            try:
+                mtime = os.stat(dirpath).st_mtime_ns  # taken before listing, so changes made while listing are seen
+            except OSError:  # the directory doesn't exist (anymore)
+                continue
+            old_entry = old_dirs.get(dirpath)
+            if old_entry is not None and old_entry[0] == mtime:
+                new_dirs[dirpath] = old_entry
+            else:
+                filepaths, subdirpaths = scan_dir(dirpath)
+                n = len(dirpath)
+                entry = (mtime, {p[n:] for p in filepaths}, {p[n:] for p in subdirpaths})
+                # Note: A change in mtime alone (our own writes, or the save of the index) doesn't need a save
+                n_changes += _n_index_entry_changes(old_entry, entry)
+                new_dirs[dirpath] = entry
+            dirpaths.extend(dirpath + name + file_sep for name in new_dirs[dirpath][2])
+        n_changes += sum(_n_index_entry_changes(old_dirs[dirpath], None) for dirpath in old_dirs.keys() - new_dirs)
+        self._dirs = new_dirs
+        self._n_unsaved_changes += n_changes
+        if self._n_unsaved_changes >= self.save_threshold:
+            self.save_index()
+
+    def _ensure_index(self):
+        if self._dirs is None:
+            self.refresh_index()
+
+    def _index_dir_entry(self, dirpath):
+        """The index entry of dirpath, made (along with those of its missing parents) if the directory is new.
+        New entries have a None mtime, so that the next refresh lists them."""
+        entry = self._dirs.get(dirpath)
+        if entry is None:
+            entry = self._dirs[dirpath] = (None, set(), set())
+            if dirpath != self.rootdir:
+                parent_dirpath, dirname = os.path.split(dirpath[:-len(file_sep)])
+                self._index_dir_entry(ensure_slash_suffix(parent_dirpath))[2].add(dirname)
+        return entry
+
+    def _index_add(self, k):
+        dirpath, filename = os.path.split(k)
+        filenames = self._index_dir_entry(ensure_slash_suffix(dirpath))[1]
+        if filename not in filenames:
+            filenames.add(filename)
+            self._n_unsaved_changes += 1
+
+    def _index_remove(self, k):
+        dirpath, filename = os.path.split(k)
+        entry = self._dirs.get(ensure_slash_suffix(dirpath))
+        if entry is not None and filename in entry[1]:
+            entry[1].remove(filename)
+            self._n_unsaved_changes += 1
+
+    # Persister methods ###############################################################################################
+    def __setitem__(self, k, v):
+        super().__setitem__(k, v)
+        self._ensure_index()
+        self._index_add(k)
+
+    def __delitem__(self, k):
+        super().__delitem__(k)
+        self._ensure_index()
+        self._index_remove(k)
+
+    def setmany(self, items):
+        items = list(items_of(items))
+        super().setmany(items)
+        self._ensure_index()
+        for k, _ in items:
+            self._index_add(k)
+
+    def delmany(self, keys):
+        keys = list(keys)
+        super().delmany(keys)
+        self._ensure_index()
+        for k in keys:
+            self._index_remove(k)
+
+    def open(self, k, mode='rb'):
+        f = super().open(k, mode)
+        if mode.startswith('w'):
+            self._ensure_index()
+            self._index_add(k)
+        return f
+
+    def __contains__(self, k):
+        self._validate_key(k)
+        self._ensure_index()
+        dirpath, filename = os.path.split(k)
+        entry = self._dirs.get(ensure_slash_suffix(dirpath))
+        return entry is not None and filename in entry[1]
+
+    def __iter__(self):
+        self.refresh_index()
+        for dirpath, (_, filenames, _) in list(self._dirs.items()):
+            for filename in filenames:
+                yield dirpath + filename
+
+    def __len__(self):
+        self.refresh_index()
+        return sum(len(filenames) for _, filenames, _ in self._dirs.values())
@@ -0,0 +1,81 @@
+"""
+Hash sharding of the files of file stores: Their files are fanned out in subdirectories named after the hash of their
+key (see HashShardedRelativization), so that no directory ends up with millions of files.
+"""
+
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from py2misc.py2store.concurrency import DFLT_MAX_WORKERS
+from py2misc.py2store.simple import (PrefixRelativization, ensure_slash_suffix, file_key_wrap, file_sep,
+                                     scandir_filepaths)
+
+class HashShardedRelativization(PrefixRelativization):
+    """A key wrap that, like PrefixRelativization, maps relative paths to absolute ones, but also fans the files out
+    into shard_levels levels of subdirectories, named after the (hex) md5 hash of the key.
+
+    So that directories don't end up with millions of files (which makes most file systems slow),
+    a key 'the/file/we.want' is stored under
+        /A/VERY/LONG/ROOT/FOLDER/25/69/the/file/we.want
+    (with shard_levels=2 and shard_width=2), and the key is recovered by removing the shard directories.
+
+    >>> key_wrap = HashShardedRelativization('/root/', shard_levels=2)
+    >>> key_wrap._id_of_key('the/file/we.want')
+    '/root/25/69/the/file/we.want'
+    >>> key_wrap._key_of_id('/root/25/69/the/file/we.want')
+    'the/file/we.want'
+    """
+
+    def __init__(self, _prefix="", shard_levels=2, shard_width=2):
+        super().__init__(_prefix)
+        self.shard_levels = shard_levels
+        self.shard_width = shard_width
+
+    def _shard_of_key(self, k):
+        h, w = hashlib.md5(k.encode()).hexdigest(), self.shard_width
+        return ''.join(h[i * w:(i + 1) * w] + file_sep for i in range(self.shard_levels))
+
+    def _id_of_key(self, k):
+        return self._prefix + self._shard_of_key(k) + k
+
+    def _key_of_id(self, _id):
+        return _id[self._prefix_length:].split(file_sep, self.shard_levels)[-1]
+
+    _id_of_key_prefix = None  # the (hash) shards scatter keys, so key prefixes and ranges aren't id prefixes or ranges
+
+
+def _remove_empty_dirs(dirpath, rootdir):
+    """Remove dirpath, and then its parents, as long as they're empty (and not rootdir)"""
+    while dirpath.startswith(rootdir) and len(dirpath) > len(rootdir):
+        try:
+            os.rmdir(dirpath)
+        except OSError:  # not empty (or already removed)
+            return
+        dirpath = os.path.dirname(dirpath)
+
+
+def reshard_file_store(rootdir, shard_levels, from_shard_levels=0, max_workers=DFLT_MAX_WORKERS):
+    """Move the files of a (Simple or Pickle) file store from a from_shard_levels layout to a shard_levels layout,
+    in place, with max_workers threads.
+    For example, to move the files of an existing SimpleFileStore to the layout of
+    SimpleFileStore(rootdir, shard_levels=2), do
+        reshard_file_store(rootdir, shard_levels=2)
+    The directories left empty by the moves are removed.
+    Don't write to the store while it's being resharded.
+    """
+    rootdir = ensure_slash_suffix(rootdir)
+    from_key_wrap, to_key_wrap = file_key_wrap(rootdir, from_shard_levels), file_key_wrap(rootdir, shard_levels)
+
+    def move(filepath):
+        new_filepath = to_key_wrap._id_of_key(from_key_wrap._key_of_id(filepath))
+        if new_filepath != filepath:
+            os.makedirs(os.path.dirname(new_filepath), exist_ok=True)
+            os.replace(filepath, new_filepath)
+            return os.path.dirname(filepath)
+
+    filepaths = list(scandir_filepaths(rootdir))  # listed before moving anything, so no file is moved twice
+    with ThreadPoolExecutor(max_workers) as executor:
+        emptied_dirpaths = set(executor.map(move, filepaths)) - {None}
+    for dirpath in sorted(emptied_dirpaths, reverse=True):  # deepest first
+        _remove_empty_dirs(dirpath, rootdir)
@@ -3,6 +3,8 @@ from py2store.util import lazyprop
 from py2store.errors import KeyValidationError
 from py2store.paths import PrefixRelativizationMixin
 from dol.paths import PrefixRelativization
+from py2misc.py2store.simple import items_of, KeyCountMixin
+from py2misc.py2store.streams import open_in_memory, check_open_mode
 
 
 # TODO: Define store type so the type is defined by it's methods, not by subclassing.
@@ -25,17 +27,33 @@ class StoreBase(MutableMapping):
             except KeyError:
                 pass''')
 
+    # Bulk operations: Per-key fallbacks. Stores that have a faster bulk path should override these.
+    def getmany(self, keys):
+        return [self[k] for k in keys]
 
-# TODO: Make identity_func "identifiable". If we use the following one, we can use == to detect it's use,
-# TODO: ... but there may be a way to annotate, register, or type any identity function so it can be detected.
-def identity_func(x):
-    return x
+    def setmany(self, items):
+        for k, v in items_of(items):
+            self[k] = v
 
+    def delmany(self, keys):
+        for k in keys:
+            del self[k]
+
+    # Streaming: An in-memory fallback. Stores that can stream (files, S3...) should override this.
+    def open(self, k, mode='rb'):
+        """A file-like object to read ('r', 'rb') or write ('w', 'wb') the value of k.
+        This fallback reads the whole value in memory, and writes it (whole) when the file is closed."""
+        return open_in_memory(self, k, mode)
+
+
+# identity_func is shared with py2store.simple, so that both recognize it (with `is`) as a hook that can be skipped.
+from py2misc.py2store.simple import (identity_func, STORE_HOOKS, specialized_store_methods,
+                                     SpecializedPicklingMixin, StoreMethodsMixin)
 
 static_identity_method = staticmethod(identity_func)
 
 
-class Store(StoreBase):
+class Store(SpecializedPicklingMixin, StoreMethodsMixin, StoreBase):
     """
     By store we mean key-value store. This could be files in a filesystem, objects in s3, or a database. Where and
     how the content is stored should be specified, but StoreInterface offers a dict-like interface to this.
@@ -44,6 +62,14 @@ class Store(StoreBase):
     __setitem__ calls: _id_of_key		        _data_of_obj
     __delitem__ calls: _id_of_key
     __iter__    calls:	            _key_of_id
+
+    getmany, setmany and delmany do the same for a batch of keys, applying each transform over the whole batch,
+    and using the store's bulk methods (if it has them) instead of a per-key loop.
+    (These, and keys, prefetch_items, open and meta, are those of py2store.simple.Store: see StoreMethodsMixin.)
+
+    Hooks that are identity_func (as static_identity_method is) are skipped: The read, write and listing paths are
+    specialized (see _specialize) when the store is made, and again whenever a hook (or the store) is (re)assigned
+    on the instance. (Redefining hooks on the class after instances were made isn't seen.)
     """
 
     # __slots__ = ('_id_of_key', '_key_of_id', '_data_of_obj', '_obj_of_data')
@@ -56,37 +82,67 @@ class Store(StoreBase):
     def __init__(self, store=None):
         if store is None:
             store = dict()
-        self.store = store
+        self.store = store  # (which specializes the store: see __setattr__)
 
     _id_of_key = static_identity_method
     _key_of_id = static_identity_method
     _data_of_obj = static_identity_method
     _obj_of_data = static_identity_method
+    # How key prefixes (and range bounds) translate to ids, if _id_of_key preserves prefixes and order (see keys)
+    _id_of_key_prefix = None
+
+    def __setattr__(self, attr, val):
+        super().__setattr__(attr, val)
+        if attr == 'store' or (attr in STORE_HOOKS and 'store' in self.__dict__):
+            self._specialize()
+
+    def __delattr__(self, attr):
+        super().__delattr__(attr)
+        if attr in STORE_HOOKS and 'store' in self.__dict__:
+            self._specialize()
+
+    def _specialize(self):
+        """Bind the functions that the dunders delegate to (see specialized_store_methods)"""
+        self.__dict__.update(specialized_store_methods(  # (not setattr, which would re-specialize)
+            self.store, self._id_of_key, self._key_of_id, self._data_of_obj, self._obj_of_data))
+
+    @property
+    def _backend(self):  # (see StoreMethodsMixin)
+        return self.store
 
     # Read ####################################################################
     def __getitem__(self, k):
-        return self._obj_of_data(self.store.__getitem__(self._id_of_key(k)))
+        return self._getitem(k)
 
     def get(self, k, default=None):
         self.store.get(self._id_of_key(k), default=default)
 
     # Explore ####################################################################
     def __iter__(self):
-        return map(self._key_of_id, self.store.__iter__())
+        return self._iter()
 
     def __len__(self):
         return self.store.__len__()
 
     def __contains__(self, k):
-        return self.store.__contains__(self._id_of_key(k))
+        return self._contains(k)
+
+    def keys(self, prefix=None, start=None, stop=None):
+        """The keys that start with prefix and/or are in the [start, stop) range, in sorted order.
+        Served by the store's iter_prefix and iter_range (see py2store.sorted_keys.SortedKeysPersister) if it has them,
+        and _id_of_key_prefix is given. If not, all keys are listed, filtered and sorted.
+        Without arguments, the usual KeysView."""
+        if prefix is None and start is None and stop is None:
+            return StoreBase.keys(self)
+        return super().keys(prefix, start, stop)
 
     # Write ####################################################################
     def __setitem__(self, k, v):
-        return self.store.__setitem__(self._id_of_key(k), self._data_of_obj(v))
+        return self._setitem(k, v)
 
     # Delete ####################################################################
     def __delitem__(self, k):
-        return self.store.__delitem__(self._id_of_key(k))
+        return self._delitem(k)
 
     def clear(self):
         raise NotImplementedError('''
@@ -109,6 +165,7 @@ class Store(StoreBase):
 import os
 import re
 from glob import iglob
+from py2misc.py2store.simple import scandir_filepaths
 
 ########################################################################################################################
 # File system navigation: Utils
@@ -179,12 +236,27 @@ class SimpleFileStoreBase(StoreBase):
         os.remove(k)
 
     def __iter__(self):
-        return iter_filepaths_in_folder_recursively(self.rootdir)
+        return scandir_filepaths(self.rootdir)
+
+    def open(self, k, mode='rb'):
+        """The (real) file object of k"""
+        check_open_mode(mode)
+        self._validate_key(k)
+        return open(k, mode)
+
+
+class CountedSimpleFileStoreBase(KeyCountMixin, SimpleFileStoreBase):
+    """A SimpleFileStoreBase whose __len__ doesn't walk the whole rootdir (but for the first time, or on resync_len)"""
 
 
 class SimpleFileStore(PrefixRelativization, Store):
-    def __init__(self, rootdir, mode='t'):
-        store = SimpleFileStoreBase(rootdir, mode)
+    """A local file store, with keys relative to rootdir.
+    If count_keys=True, the number of keys is maintained through writes and deletes (see KeyCountMixin),
+    instead of being counted at every len(store) call.
+    """
+
+    def __init__(self, rootdir, mode='t', count_keys=False):
+        store = (CountedSimpleFileStoreBase if count_keys else SimpleFileStoreBase)(rootdir, mode)
         PrefixRelativization.__init__(self, _prefix=rootdir)
         Store.__init__(self, store=store)
 
@@ -223,7 +295,8 @@ class DirReaderBase(StoreBase):
         return k.startswith(self._prefix) and os.path.isdir(k)
 
     def __iter__(self):
-        return filter(os.path.isdir, map(lambda x: os.path.join(self._prefix, x), os.listdir(self._prefix)))
+        with os.scandir(self._prefix) as dir_entries:
+            return iter([entry.path for entry in dir_entries if entry.is_dir()])
 
     def __getitem__(self, k):
         if os.path.isdir(k):
@@ -301,8 +374,7 @@ class DirStoreLeveled(PrefixRelativizationMixin, Store):
 ########################################################################################################################
 # S3
 
-from botocore.exceptions import ClientError
-from py2misc.py2store.simple import get_s3_resource
+from py2misc.py2store.simple import get_s3_resource, S3BucketPersister, DFLT_S3_MAX_WORKERS
 from py2store.stores.s3_store import DFLT_AWS_S3_ENDPOINT, DFLT_BOTO_CLIENT_VERIFY, DFLT_CONFIG
 from functools import partial
 
@@ -312,14 +384,14 @@ DFLT_S3_OBJ_OF_DATA = encode_as_utf8
 from py2store.errors import NoSuchKeyError
 
 
-class S3BucketStoreBase(StoreBase):
-    def __init__(self, bucket_name: str, _s3_bucket, _prefix: str = ''):
+class S3BucketStoreBase(S3BucketPersister, StoreBase):
+    def __init__(self, bucket_name: str, _s3_bucket, _prefix: str = '', max_workers=DFLT_S3_MAX_WORKERS):
         """
         S3 Bucket accessor.
         This class is meant to be subclassed, used with other mixins that actually add read and write methods.
-        All S3BucketDacc does is create (or maintain) a bucket object, offer validation (is_valid)
-        and assertion methods (assert_is_valid) methods to check that a key is prefixed by given _prefix, and
-        more importantly, offers a hidden _id_of_key method that returns an object for a given key.
+        Keys are the (full) s3 keys, as strings, and all requests are made with the bucket's client: Membership is
+        checked with a head_object request, and bulk reads and writes (getmany, setmany) are made concurrently, by a
+        pool of max_workers threads (see py2store.simple.S3BucketPersister, whose methods these are).
 
         Observe that the _s3_bucket constructor argument is a boto3 s3.Bucket, but offers other factories to make
         a S3BucketDacc instance.
@@ -329,70 +401,9 @@ class S3BucketStoreBase(StoreBase):
         :param bucket_name: Bucket name (string)
         :param _s3_bucket: boto3 s3.Bucket object.
         :param _prefix: prefix that all accessed keys should have
+        :param max_workers: number of threads of the pool of concurrent (bulk) operations
         """
-        self.bucket_name = bucket_name
-        self._s3_bucket = _s3_bucket
-        self._prefix = _prefix
-
-    def __getitem__(self, k):
-        try:  # TODO: Didn't manage to catch this exception for some reason. Make it work!
-            return k.get()['Body'].read()
-        except Exception as e:
-            raise NoSuchKeyError(f"Key wasn't found: {k}")
-            # if hasattr(e, '__name__'):
-            #     if e.__name__ == 'NoSuchKey':
-            #         raise NoSuchKeyError("Key wasn't found: {}".format(k))
-            # raise  # if you got so far
-
-    def __setitem__(self, k, v):
-        """
-        Write data to s3 key.
-        Method will check if key is valid before writing data to it,
-        but will not check if data is already stored there.
-        This means that any data previously stored at the key's location will be lost.
-        :param k: s3 key
-        :param v: data to write
-        :return: None
-        """
-        # TODO: Faster to ignore s3 response, but perhaps better to get it, possibly cache it, and possibly handle it
-        k.put(Body=v)
-
-    def __delitem__(self, k):
-        """
-        Delete data stored at key k.
-        Method will check if key is valid before deleting its data.
-        :param k:
-        :return:
-        """
-        # TODO: Faster to ignore s3 response, but perhaps better to get it, possibly cache it, and possibly handle it
-        try:  # TODO: Didn't manage to catch this exception for some reason. Make it work!
-            k.delete()
-        except Exception as e:
-            if hasattr(e, '__name__'):
-                if e.__name__ == 'NoSuchKey':
-                    raise NoSuchKeyError(f"Key wasn't found: {k}")
-            raise  # if you got so far
-
-    def __iter__(self):
-        return iter(self._s3_bucket.objects.filter(Prefix=self._prefix))
-
-    def __contains__(self, k):
-        """
-        Check if key exists
-        :param k: A key to search for
-        :return: True if k exists, False if not
-        """
-        # TODO: s3_client.head_object(Bucket=dacc.bucket_name, Key=k) slightly more efficient but needs boto3.client
-        try:
-            k.load()
-            return True  # if all went well
-        except ClientError as e:
-            if e.response['Error']['Code'] == "404":
-                # The object does not exist.
-                return False
-            else:
-                # Something else has gone wrong.
-                raise
+        super().__init__(bucket_name, _s3_bucket, _prefix, max_workers=max_workers)
 
     @classmethod
     def from_s3_resource_kwargs(cls,
@@ -421,22 +432,34 @@ class S3BucketStoreBase(StoreBase):
 
 
 class S3Store(Store):
+    """A store of an S3 bucket's data, with (prefix relative) string keys.
+    values() and items() fetch values concurrently (but yield them in key order), by max_workers threads, as getmany
+    and setmany do.
+    """
+
     def __init__(self, bucket_name: str, _s3_bucket, _prefix: str = '',
-                 _data_of_obj=lambda x: x, _obj_of_data=DFLT_S3_OBJ_OF_DATA):
-        store = S3BucketStoreBase(bucket_name, _s3_bucket, _prefix)
+                 _data_of_obj=lambda x: x, _obj_of_data=DFLT_S3_OBJ_OF_DATA, max_workers=DFLT_S3_MAX_WORKERS):
+        store = S3BucketStoreBase(bucket_name, _s3_bucket, _prefix, max_workers=max_workers)
         key_wrap = PrefixRelativization(_prefix=store._prefix)
+        self._id_of_key = key_wrap._id_of_key  # the store's keys are (full) s3 key strings
+        self._key_of_id = key_wrap._key_of_id
+        super().__init__(store=store)
 
-        def _id_of_key(k):
-            return store._s3_bucket.Object(key=key_wrap._id_of_key(k))
+    def items(self):
+        return self.store.imap(lambda k: (k, self[k]), iter(self))
 
-        self._id_of_key = _id_of_key
+    def values(self):
+        return (v for _, v in self.items())
 
-        def _key_of_id(_id):
-            return key_wrap._key_of_id(_id.key)
+    def close(self):
+        """Shut down the thread pool of the store (see S3BucketPersister.close)"""
+        self.store.close()
 
-        self._key_of_id = _key_of_id
+    def __enter__(self):
+        return self
 
-        super().__init__(store=store)
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
 
     @classmethod
     def from_s3_resource_kwargs(cls,
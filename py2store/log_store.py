@@ -0,0 +1,408 @@
+"""
+A log-structured (Bitcask-like) persister: Values are appended to a few big segment files instead of having a file
+each, and an in-memory key directory says where (segment, offset, length) the current value of each key is.
+
+Compared to one-file-per-key persisters (like py2store.simple.SimpleFilePersister), writing is one append, reading
+is one pread, and there's no inode or directory entry per key, which makes a big difference for millions of small
+values. The price is that overwritten and deleted values still take space in the segments until they're compacted.
+
+Segment files are named {segment_id:08d}.data, and are made of records:
+    crc32 (4 bytes) | key length (4 bytes) | value length (4 bytes) | key (utf8) | value
+(a deletion is a record with a TOMBSTONE value length and no value).
+When a segment is full, it's closed for good (it is immutable from then on) and a hint file ({segment_id:08d}.hint),
+listing the keys and value positions of the segment (but not the values), is written next to it so that the key
+directory can be rebuilt, at startup, without reading the values.
+"""
+
+import os
+import struct
+import zlib
+from threading import RLock, Thread
+
+from py2misc.py2store.simple import Persister, Store, PickleValWrap, items_of
+from py2misc.py2store.durability import fsync_path
+
+DFLT_MAX_SEGMENT_BYTES = 64 * 1024 * 1024
+TOMBSTONE = 0xFFFFFFFF  # the value length that marks a deletion
+
+record_header = struct.Struct('>III')  # crc32, key length, value length
+hint_header = struct.Struct('>Q')  # size of the segment the hint file was made for
+hint_record_header = struct.Struct('>IIQ')  # key length, value length, value offset
+
+
+def _segment_filename(segment_id, ext='.data'):
+    return f"{segment_id:08d}{ext}"
+
+
+def _encode_record(k, v):
+    key_bytes = k.encode()
+    val_len = TOMBSTONE if v is None else len(v)
+    header_and_data = record_header.pack(0, len(key_bytes), val_len)[4:] + key_bytes + (v or b'')
+    return struct.pack('>I', zlib.crc32(header_and_data)) + header_and_data, len(key_bytes)
+
+
+def _n_segments_for(live, max_segment_bytes):
+    """The (most) segments that compacting the live (key, location) pairs makes: All but the last are (over) full"""
+    n_bytes = sum(record_header.size + len(k.encode()) + val_len for k, (_, _, val_len) in live)
+    return -(-n_bytes // max_segment_bytes)
+
+
+if hasattr(os, 'pread'):
+    _pread = os.pread
+else:  # windows
+    def _pread(fd, length, offset):
+        os.lseek(fd, offset, os.SEEK_SET)
+        return os.read(fd, length)
+
+
+class LogStructuredPersister(Persister):
+    """A persister that appends values (bytes) to segment files, and keeps the location of the values of the (str)
+    keys in memory.
+
+    Writes are appended to the active segment, which is rolled over to a new one when it's over max_segment_bytes.
+    Calling compact() (or start_compaction(), to do it in a background thread) rewrites the live values of the
+    immutable segments into fewer segments, reclaiming the space of overwritten and deleted values.
+
+    Only one persister (one process) should write to a given dirpath at a time.
+
+    >>> import tempfile
+    >>> s = LogStructuredPersister(tempfile.mkdtemp(), max_segment_bytes=100)
+    >>> for i in range(10):
+    ...     s['key'] = b'value number %d' % i
+    >>> s['other_key'] = b'other value'
+    >>> del s['other_key']
+    >>> list(s), s['key']
+    (['key'], b'value number 9')
+    >>> n_segments = len(s.segment_ids())
+    >>> s.compact()
+    >>> len(s.segment_ids()) < n_segments
+    True
+    >>> s.close()
+    >>> s = LogStructuredPersister(s.dirpath)  # the key directory is rebuilt from the segments (and hints)
+    >>> list(s), s['key']
+    (['key'], b'value number 9')
+    """
+
+    def __init__(self, dirpath, max_segment_bytes=DFLT_MAX_SEGMENT_BYTES):
+        self.dirpath = dirpath
+        self.max_segment_bytes = max_segment_bytes
+        os.makedirs(dirpath, exist_ok=True)
+        self._lock = RLock()
+        self._keydir = {}  # key -> (segment_id, value offset, value length)
+        self._read_fds = {}  # segment_id -> file descriptor open for reading
+        self._n_reading = 0  # number of preads in flight (made without the lock)
+        self._retired_fds = []  # read fds of compacted segments, closed when no pread is in flight
+        self._active_hints = []  # the (key, value offset, value length) of the records of the active segment
+        self._load_keydir()
+        self._open_active_segment(max(self.segment_ids(), default=0))
+
+    def _filepath(self, segment_id, ext='.data'):
+        return os.path.join(self.dirpath, _segment_filename(segment_id, ext))
+
+    def segment_ids(self):
+        """The ids of the segments, in the order they were written"""
+        return sorted(int(name[:-len('.data')]) for name in os.listdir(self.dirpath) if name.endswith('.data'))
+
+    # Rebuilding the key directory ####################################################################################
+    def _load_keydir(self):
+        segment_ids = self.segment_ids()
+        for segment_id in segment_ids:
+            is_active = segment_id == segment_ids[-1]
+            hints = None if is_active else self._read_hints(segment_id)
+            if hints is None:
+                hints = self._scan_segment(segment_id, truncate_torn_tail=is_active)
+            if is_active:
+                self._active_hints = hints
+            for k, val_offset, val_len in hints:
+                if val_len == TOMBSTONE:
+                    self._keydir.pop(k, None)
+                else:
+                    self._keydir[k] = (segment_id, val_offset, val_len)
+
+    def _read_hints(self, segment_id):
+        """The (key, value offset, value length) of the records of the segment, read from its hint file,
+        or None if there's no (valid) hint file"""
+        try:
+            with open(self._filepath(segment_id, '.hint'), 'rb') as fp:
+                data = fp.read()
+        except OSError:
+            return None
+        if len(data) < hint_header.size or \
+                hint_header.unpack_from(data)[0] != os.path.getsize(self._filepath(segment_id)):
+            return None  # the hint file is not the one of the current segment file
+        hints, pos = [], hint_header.size
+        while pos < len(data):
+            key_len, val_len, val_offset = hint_record_header.unpack_from(data, pos)
+            pos += hint_record_header.size
+            hints.append((data[pos:pos + key_len].decode(), val_offset, val_len))
+            pos += key_len
+        return hints
+
+    def _scan_segment(self, segment_id, truncate_torn_tail=False):
+        """The (key, value offset, value length) of the records of the segment, read from the segment itself.
+        Stops at the first incomplete or corrupted record (and truncates the segment there if truncate_torn_tail)."""
+        filepath = self._filepath(segment_id)
+        with open(filepath, 'rb') as fp:
+            data = fp.read()
+        hints, pos = [], 0
+        while pos + record_header.size <= len(data):
+            crc, key_len, val_len = record_header.unpack_from(data, pos)
+            record_len = record_header.size + key_len + (0 if val_len == TOMBSTONE else val_len)
+            if pos + record_len > len(data) or zlib.crc32(data[pos + 4:pos + record_len]) != crc:
+                break
+            key_offset = pos + record_header.size
+            hints.append((data[key_offset:key_offset + key_len].decode(), key_offset + key_len, val_len))
+            pos += record_len
+        if pos < len(data) and truncate_torn_tail:
+            os.truncate(filepath, pos)
+        return hints
+
+    def _write_hints(self, segment_id, hints, tmp_ext=''):
+        hint_filepath = self._filepath(segment_id, '.hint' + tmp_ext)
+        with open(hint_filepath, 'wb') as fp:
+            fp.write(hint_header.pack(os.path.getsize(self._filepath(segment_id, '.data' + tmp_ext))))
+            for k, val_offset, val_len in hints:
+                key_bytes = k.encode()
+                fp.write(hint_record_header.pack(len(key_bytes), val_len, val_offset) + key_bytes)
+
+    # Segment management ##############################################################################################
+    def _open_active_segment(self, segment_id):
+        self._active_segment_id = segment_id
+        self._active_fd = os.open(self._filepath(segment_id), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o666)
+        self._active_size = os.fstat(self._active_fd).st_size
+
+    def _roll_active_segment(self, next_segment_id=None):
+        """Close the active segment for good (writing its hint file), and open a new one (with the next id, or
+        next_segment_id, if given)"""
+        os.close(self._active_fd)
+        segment_id = self._active_segment_id
+        self._write_hints(segment_id, self._active_hints)
+        self._active_hints = []
+        self._open_active_segment(segment_id + 1 if next_segment_id is None else next_segment_id)
+
+    def _read_fd(self, segment_id):
+        fd = self._read_fds.get(segment_id)
+        if fd is None:
+            fd = self._read_fds[segment_id] = os.open(self._filepath(segment_id), os.O_RDONLY)
+        return fd
+
+    def _append(self, records):
+        """Append (key, value) records (a None value being a deletion) to the active segment, in one write,
+        and return the (key, value offset, value length) of each"""
+        chunks, hints, offset = [], [], self._active_size
+        for k, v in records:
+            record, key_len = _encode_record(k, v)
+            chunks.append(record)
+            hints.append((k, offset + record_header.size + key_len, TOMBSTONE if v is None else len(v)))
+            offset += len(record)
+        os.write(self._active_fd, b''.join(chunks))
+        self._active_size = offset
+        self._active_hints.extend(hints)
+        return hints
+
+    def _set_records(self, records):
+        with self._lock:
+            segment_id = self._active_segment_id
+            for k, val_offset, val_len in self._append(records):
+                if val_len == TOMBSTONE:
+                    self._keydir.pop(k, None)
+                else:
+                    self._keydir[k] = (segment_id, val_offset, val_len)
+            if self._active_size >= self.max_segment_bytes:
+                self._roll_active_segment()
+
+    # Reads: The lock is only held to look up the location (and fd) of values, not during the preads ##################
+    def _begin_reads(self, keys):
+        """The (fd, value offset, value length) of the values of keys, registering the preads to come as in flight
+        (so compaction doesn't close their fds meanwhile). Must be followed by _end_reads."""
+        with self._lock:
+            locations = []
+            for k in keys:
+                segment_id, val_offset, val_len = self._keydir[k]
+                locations.append((self._read_fd(segment_id), val_offset, val_len))
+            self._n_reading += 1
+            return locations
+
+    def _end_reads(self):
+        with self._lock:
+            self._n_reading -= 1
+            self._close_retired_fds()
+
+    def _close_retired_fds(self):
+        if self._n_reading == 0:
+            for fd in self._retired_fds:
+                os.close(fd)
+            self._retired_fds.clear()
+
+    def _read(self, locations):
+        try:
+            return [_pread(fd, val_len, val_offset) for fd, val_offset, val_len in locations]
+        finally:
+            self._end_reads()
+
+    # Persister methods ###############################################################################################
+    def __getitem__(self, k):
+        return self._read(self._begin_reads([k]))[0]
+
+    def __setitem__(self, k, v):
+        self._set_records([(k, v)])
+
+    def __delitem__(self, k):
+        with self._lock:
+            if k not in self._keydir:
+                raise KeyError(k)
+            self._set_records([(k, None)])
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._keydir))
+
+    def __len__(self):
+        return len(self._keydir)
+
+    def __contains__(self, k):
+        return k in self._keydir
+
+    def getmany(self, keys):
+        return self._read(self._begin_reads(keys))
+
+    def setmany(self, items):
+        self._set_records(list(items_of(items)))
+
+    def delmany(self, keys):
+        with self._lock:
+            keys = list(keys)
+            for k in keys:
+                if k not in self._keydir:
+                    raise KeyError(k)
+            self._set_records([(k, None) for k in keys])
+
+    # Compaction ######################################################################################################
+    def _immutable_live(self, stop=None):
+        """The ids of the segments before stop (the active one, by default), and the (key, location) of their live
+        values"""
+        stop = self._active_segment_id if stop is None else stop
+        segment_ids = [i for i in self.segment_ids() if i < stop]
+        segment_id_set = set(segment_ids)
+        return segment_ids, [(k, loc) for k, loc in self._keydir.items() if loc[0] in segment_id_set]
+
+    def compact(self):
+        """Rewrite the live values of the immutable (i.e. all but the active) segments into as few segments as
+        possible, reclaiming the space of the values that were overwritten or deleted.
+
+        The values are copied without holding the lock, so reads and writes can go on during the compaction.
+        The compacted segments take the ids of the first of the old ones, so that a key's records keep their order
+        with respect to the records of later segments. If the live values need more segments than there are old ones
+        (when max_segment_bytes was lowered), the active segment is closed (and compacted too), and the new active
+        segment's id leaves room for the ids of the extra segments.
+        """
+        with self._lock:
+            old_segment_ids, live = self._immutable_live()
+            if not old_segment_ids:
+                return
+            if _n_segments_for(live, self.max_segment_bytes) > len(old_segment_ids):
+                active_segment_id = self._active_segment_id
+                old_segment_ids, live = self._immutable_live(stop=active_segment_id + 1)
+                n_extra = max(0, _n_segments_for(live, self.max_segment_bytes) - len(old_segment_ids))
+                self._roll_active_segment(next_segment_id=active_segment_id + 1 + n_extra)
+                new_segment_ids = old_segment_ids + list(range(active_segment_id + 1, active_segment_id + 1 + n_extra))
+            else:
+                new_segment_ids = old_segment_ids
+
+        # copy the live values to new (temporary) segments
+        new_locations, new_segments = {}, []  # new_segments: (segment_id, hints)
+        new_segment_ids = iter(new_segment_ids)
+        try:
+            fp, hints, size = None, None, 0
+            read_fds = {i: os.open(self._filepath(i), os.O_RDONLY) for i in old_segment_ids}
+            try:
+                for k, (segment_id, val_offset, val_len) in sorted(live, key=lambda x: x[1]):
+                    if fp is None or size >= self.max_segment_bytes:
+                        if fp is not None:
+                            fp.close()
+                        new_segments.append((next(new_segment_ids), []))
+                        fp, hints, size = open(self._filepath(new_segments[-1][0], '.data.tmp'), 'wb'), \
+                                          new_segments[-1][1], 0
+                    record, key_len = _encode_record(k, _pread(read_fds[segment_id], val_len, val_offset))
+                    fp.write(record)
+                    hints.append((k, size + record_header.size + key_len, val_len))
+                    new_locations[k] = ((segment_id, val_offset, val_len),
+                                        (new_segments[-1][0], hints[-1][1], val_len))
+                    size += len(record)
+            finally:
+                if fp is not None:
+                    fp.close()
+                for fd in read_fds.values():
+                    os.close(fd)
+            for segment_id, segment_hints in new_segments:
+                self._write_hints(segment_id, segment_hints, tmp_ext='.tmp')
+                # (durable before they replace the old segments, whose values may have been made durable by sync)
+                fsync_path(self._filepath(segment_id, '.data.tmp'))
+                fsync_path(self._filepath(segment_id, '.hint.tmp'))
+        except BaseException:
+            for segment_id, _ in new_segments:
+                for ext in ('.data.tmp', '.hint.tmp'):
+                    if os.path.exists(self._filepath(segment_id, ext)):
+                        os.remove(self._filepath(segment_id, ext))
+            raise
+
+        # swap the old segments for the new ones
+        with self._lock:
+            for segment_id in old_segment_ids:
+                fd = self._read_fds.pop(segment_id, None)
+                if fd is not None:
+                    self._retired_fds.append(fd)  # (preads in flight may still be using it)
+            self._close_retired_fds()
+            for segment_id, _ in new_segments:
+                os.replace(self._filepath(segment_id, '.data.tmp'), self._filepath(segment_id))
+                os.replace(self._filepath(segment_id, '.hint.tmp'), self._filepath(segment_id, '.hint'))
+            fsync_path(self.dirpath)  # the renames are durable before any old segment is removed
+            reused_segment_ids = {segment_id for segment_id, _ in new_segments}
+            for segment_id in (i for i in old_segment_ids if i not in reused_segment_ids):
+                os.remove(self._filepath(segment_id))
+                if os.path.exists(self._filepath(segment_id, '.hint')):
+                    os.remove(self._filepath(segment_id, '.hint'))
+            fsync_path(self.dirpath)
+            for k, (old_location, new_location) in new_locations.items():
+                if self._keydir.get(k) == old_location:  # if not, the key was overwritten or deleted meanwhile
+                    self._keydir[k] = new_location
+
+    def start_compaction(self):
+        """Compact in a background (daemon) thread. Returns the thread (join it to wait for the compaction)"""
+        thread = Thread(target=self.compact, daemon=True)
+        thread.start()
+        return thread
+
+    # Closing #########################################################################################################
+    def sync(self):
+        """fsync the active segment"""
+        with self._lock:
+            os.fsync(self._active_fd)
+
+    def close(self):
+        with self._lock:
+            os.close(self._active_fd)
+            for fd in self._read_fds.values():
+                os.close(fd)
+            self._read_fds.clear()
+            self._retired_fds, retired_fds = [], self._retired_fds
+            for fd in retired_fds:
+                os.close(fd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}('{self.dirpath}')"
+
+
+class PickleLogStore(Store):
+    """A store that pickles objects into a LogStructuredPersister"""
+
+    def __init__(self, dirpath, max_segment_bytes=DFLT_MAX_SEGMENT_BYTES, protocol=None, fix_imports=True):
+        persister = LogStructuredPersister(dirpath, max_segment_bytes=max_segment_bytes)
+        val_wrap = PickleValWrap(protocol=protocol, fix_imports=fix_imports)
+        super().__init__(persister=persister, _data_of_obj=val_wrap._data_of_obj, _obj_of_data=val_wrap._obj_of_data)
@@ -0,0 +1,475 @@
+"""
+Per-operation metrics of stores.
+
+InstrumentedStore wraps a store (any of py2store.simple or py2store.kv, or any MutableMapping) and records, for each
+operation (get, set, delete, iter, contains, and the bulk getmany, setmany and delmany), the number of calls, the
+number of errors, a histogram of latencies (from which p50, p95 and p99 are computed), and the bytes read and written.
+The metrics are pulled with snapshot().
+
+Since stores wrap stores (a Store wraps a persister, a CachedStore wraps a Store...), several layers can be
+instrumented (see instrument_layers), and the snapshot of the outermost one includes those of the inner ones, so one
+can see how much of a layer's time is spent in the layers it wraps.
+
+>>> s = InstrumentedStore(dict(), name='my_store')
+>>> s['a'] = b'hello'
+>>> s['a']
+b'hello'
+>>> 'b' in s
+False
+>>> try:
+...     s['b']
+... except KeyError:
+...     pass
+>>> snapshot = s.snapshot()['my_store']
+>>> snapshot['get']['calls'], snapshot['get']['errors'], snapshot['get']['bytes']
+(2, 1, 5)
+>>> snapshot['set']['bytes'], sorted(snapshot['set']['latency'])
+(5, ['max', 'mean', 'p50', 'p95', 'p99'])
+"""
+
+import math
+import time
+from functools import partial
+from threading import Lock
+
+from py2misc.py2store.simple import Persister, items_of, getmany_of, setmany_of, delmany_of
+
+OPERATIONS = ('get', 'set', 'delete', 'iter', 'contains', 'getmany', 'setmany', 'delmany')
+BUCKETS_PER_OCTAVE = 4  # latencies are bucketed in powers of 2 ** (1 / 4), so percentiles are within ~19%
+
+
+def nbytes(v):
+    """The number of bytes of v if it's bytes-like or a string (the length, for the latter), and None if not"""
+    if isinstance(v, (bytes, bytearray, str)):
+        return len(v)
+    if isinstance(v, memoryview):
+        return v.nbytes
+    return None
+
+
+class LatencyHistogram:
+    """A histogram of latencies (in seconds), in logarithmic buckets, to compute percentiles in constant memory"""
+
+    def __init__(self):
+        self.counts = {}  # bucket -> count
+        self.n = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        bucket = math.floor(math.log2(seconds) * BUCKETS_PER_OCTAVE) if seconds > 0 else None
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.n += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, q):
+        """The (upper bound of the bucket of the) latency that q percent of the latencies are under"""
+        if self.n == 0:
+            return None
+        rank = q / 100 * self.n
+        cumul = 0
+        for bucket in sorted(self.counts, key=lambda b: -math.inf if b is None else b):
+            cumul += self.counts[bucket]
+            if cumul >= rank:
+                return 0.0 if bucket is None else min(2 ** ((bucket + 1) / BUCKETS_PER_OCTAVE), self.max)
+        return self.max
+
+    def summary(self):
+        return dict(mean=self.total / self.n if self.n else None, max=self.max,
+                    p50=self.percentile(50), p95=self.percentile(95), p99=self.percentile(99))
+
+
+class OperationMetrics:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.bytes = 0
+        self.items = 0
+        self.latency = LatencyHistogram()
+
+    def snapshot(self):
+        return dict(calls=self.calls, errors=self.errors, bytes=self.bytes, items=self.items,
+                    latency=self.latency.summary())
+
+
+class InstrumentedStore(Persister):
+    """A wrapper of a store that records per-operation metrics (see the module's docs).
+
+    If enabled is False (or set to False later), operations go straight to the store, with only the cost of checking
+    the flag. Bytes are counted (with the sizeof function, nbytes by default) for the values that are bytes-like or
+    strings: Instrument the persister layer (see instrument_layers) to count the bytes of serialized values.
+    For iter, the latency is the time spent getting the keys (the total time of the calls to next on the iterator),
+    and items is the number of keys listed. For bulk operations, items is the number of keys (or items).
+    """
+
+    def __init__(self, store, name=None, enabled=True, sizeof=nbytes):
+        self.store = store
+        self.name = name or type(store).__name__
+        self.enabled = enabled
+        self.sizeof = sizeof
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        """Zero all metrics"""
+        with self._lock:
+            self.metrics = {op: OperationMetrics() for op in OPERATIONS}
+
+    def _record(self, op, seconds, error=False, n_bytes=None, n_items=0):
+        with self._lock:
+            m = self.metrics[op]
+            m.calls += 1
+            m.errors += error
+            m.items += n_items
+            if n_bytes:
+                m.bytes += n_bytes
+            m.latency.add(seconds)
+
+    def _timed(self, op, func, *args, sizeof_result=None, n_bytes=None, n_items=0):
+        tic = time.perf_counter()
+        try:
+            result = func(*args)
+        except BaseException:
+            self._record(op, time.perf_counter() - tic, error=True, n_items=n_items)
+            raise
+        seconds = time.perf_counter() - tic
+        if sizeof_result is not None:
+            n_bytes = sizeof_result(result)
+        self._record(op, seconds, n_bytes=n_bytes, n_items=n_items)
+        return result
+
+    def _sum_of_sizes(self, vals):
+        return sum(size for size in map(self.sizeof, vals) if size)
+
+    # Operations ######################################################################################################
+    def __getitem__(self, k):
+        if not self.enabled:
+            return self.store[k]
+        return self._timed('get', self.store.__getitem__, k, sizeof_result=self.sizeof)
+
+    def __setitem__(self, k, v):
+        if not self.enabled:
+            self.store[k] = v
+            return
+        self._timed('set', self.store.__setitem__, k, v, n_bytes=self.sizeof(v))
+
+    def __delitem__(self, k):
+        if not self.enabled:
+            del self.store[k]
+            return
+        self._timed('delete', self.store.__delitem__, k)
+
+    def __contains__(self, k):
+        if not self.enabled:
+            return k in self.store
+        return self._timed('contains', self.store.__contains__, k)
+
+    def __iter__(self):
+        if not self.enabled:
+            yield from self.store
+            return
+        seconds, n_keys = 0.0, 0
+        tic = time.perf_counter()
+        try:
+            it = iter(self.store)
+            seconds += time.perf_counter() - tic
+            while True:
+                tic = time.perf_counter()
+                try:
+                    k = next(it)
+                except StopIteration:
+                    seconds += time.perf_counter() - tic
+                    break
+                seconds += time.perf_counter() - tic
+                n_keys += 1
+                yield k
+        except GeneratorExit:  # the consumer stopped early: still a (successful) listing
+            pass
+        except BaseException:
+            self._record('iter', seconds + time.perf_counter() - tic, error=True, n_items=n_keys)
+            raise
+        self._record('iter', seconds, n_items=n_keys)
+
+    def __len__(self):
+        return len(self.store)
+
+    def getmany(self, keys):
+        keys = list(keys)
+        store_getmany = partial(getmany_of, self.store)
+        if not self.enabled:
+            return store_getmany(keys)
+        return self._timed('getmany', store_getmany, keys, sizeof_result=self._sum_of_sizes, n_items=len(keys))
+
+    def setmany(self, items):
+        items = list(items_of(items))
+        store_setmany = partial(setmany_of, self.store)
+        if not self.enabled:
+            store_setmany(items)
+            return
+        self._timed('setmany', store_setmany, items,
+                    n_bytes=self._sum_of_sizes(v for _, v in items), n_items=len(items))
+
+    def delmany(self, keys):
+        keys = list(keys)
+        store_delmany = partial(delmany_of, self.store)
+        if not self.enabled:
+            store_delmany(keys)
+            return
+        self._timed('delmany', store_delmany, keys, n_items=len(keys))
+
+    def __getattr__(self, attr):  # so that the store's other attributes (and methods) are still reachable
+        if attr == 'store':
+            raise AttributeError(attr)
+        return getattr(self.store, attr)
+
+    # Metrics #########################################################################################################
+    def inner_instrumented_stores(self):
+        """The InstrumentedStores wrapped (directly or not) by this one, outermost first"""
+        inner = []
+        obj = self.store
+        seen = {id(self)}
+        while obj is not None and id(obj) not in seen:
+            seen.add(id(obj))
+            if isinstance(obj, InstrumentedStore):
+                inner.append(obj)
+            obj = _wrapped_store(obj)
+        return inner
+
+    def snapshot(self, nested=True):
+        """A {name: {operation: metrics}} dict of the metrics of this store (and of the instrumented stores it wraps,
+        if nested), with only the operations that were called. Names of nested stores are prefixed with the names of
+        the stores that wrap them (e.g. 'MyStore/persister')."""
+        with self._lock:
+            own = {op: m.snapshot() for op, m in self.metrics.items() if m.calls}
+        snapshot = {self.name: own}
+        if nested:
+            path = self.name
+            for inner in self.inner_instrumented_stores():
+                path = f"{path}/{inner.name}"
+                snapshot[path] = inner.snapshot(nested=False)[inner.name]
+        return snapshot
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.store!r}, name={self.name!r})"
+
+
+def _wrapped_store(store):
+    """The store (or persister) that store wraps, if any (the store attribute for kv and caching stores, the
+    persister attribute for py2store.simple stores)"""
+    for attr in ('store', 'persister'):
+        wrapped = store.__dict__.get(attr) if hasattr(store, '__dict__') else None
+        if wrapped is not None:
+            return wrapped
+    return None
+
+
+def instrument_layers(store, name=None, enabled=True, sizeof=nbytes):
+    """Instrument store, and every store (or persister) it wraps, down to the innermost one, and return the
+    instrumented (outermost) store. The inner layers are named after the attribute they are held in ('store' or
+    'persister'), so their snapshot names read like 'Store/persister'.
+
+    >>> from py2misc.py2store.simple import DictPickleStore
+    >>> s = instrument_layers(DictPickleStore(), name='pickles')
+    >>> s['a'] = [1, 2, 3]
+    >>> snapshot = s.snapshot()
+    >>> list(snapshot)
+    ['pickles', 'pickles/persister']
+    >>> snapshot['pickles']['set']['bytes'], snapshot['pickles/persister']['set']['bytes'] > 0  # (objects, pickles)
+    (0, True)
+    """
+    obj = store
+    while True:
+        wrapped = _wrapped_store(obj)
+        if wrapped is None or isinstance(wrapped, InstrumentedStore):
+            break
+        attr = 'store' if obj.__dict__.get('store') is wrapped else 'persister'
+        setattr(obj, attr, InstrumentedStore(wrapped, name=attr, enabled=enabled, sizeof=sizeof))
+        obj = wrapped
+    return InstrumentedStore(store, name=name, enabled=enabled, sizeof=sizeof)
+
+
+def set_instrumentation(store, enabled):
+    """Enable (or disable) the instrumentation of store and of all the instrumented stores it wraps"""
+    if isinstance(store, InstrumentedStore):
+        store.enabled = enabled
+        for inner in store.inner_instrumented_stores():
+            inner.enabled = enabled
+
+
+########################################################################################################################
+# Transform pipeline tracing
+
+HOOKS = ('_id_of_key', '_key_of_id', '_data_of_obj', '_obj_of_data')
+
+
+class StageStats:
+    def __init__(self):
+        self.n_calls = 0  # counted without a lock (so with threads, a few calls may not be counted)
+        self.n_sampled = 0
+        self.sampled_seconds = 0.0
+
+
+class PipelineTracer:
+    """Times the stages of the (key and value) transform pipeline of a store: its four hooks (_id_of_key,
+    _key_of_id, _data_of_obj and _obj_of_data) and the calls to its persister (the persister attribute of
+    py2store.simple stores, the store attribute of py2store.kv ones), separately.
+
+    Every call is counted, but only 1 in sample_every calls (of each stage) is timed, so the overhead of tracing can
+    be made small. The total time of a stage is estimated as its mean (sampled) time times its number of calls.
+
+    Use trace_pipeline to make (and install) one.
+
+    >>> from py2misc.py2store.simple import DictPickleStore
+    >>> s = DictPickleStore()
+    >>> tracer = trace_pipeline(s, sample_every=2)
+    >>> for i in range(10):
+    ...     s[i] = list(range(100))
+    ...     _ = s[i]
+    >>> rows = {row['stage']: row for row in tracer.breakdown()}
+    >>> rows['_obj_of_data']['calls'], rows['_obj_of_data']['sampled'], rows['persister.get']['calls']
+    (10, 5, 10)
+    >>> round(sum(row['percent'] for row in rows.values()))
+    100
+    >>> tracer.uninstall()
+    """
+
+    def __init__(self, store, sample_every=1):
+        self.store = store
+        self.sample_every = sample_every
+        self.stages = {}
+        self._lock = Lock()
+        self._originals = None
+
+    def _stage(self, name):
+        with self._lock:
+            if name not in self.stages:
+                self.stages[name] = StageStats()
+            return self.stages[name]
+
+    def timed(self, name, func):
+        """A version of func that counts its calls, and times 1 in sample_every of them, as stage name"""
+        stage = self._stage(name)
+        sample_every = self.sample_every
+
+        def timed_func(*args, **kwargs):
+            n_calls = stage.n_calls
+            stage.n_calls = n_calls + 1
+            if n_calls % sample_every:  # (so the first call is always sampled)
+                return func(*args, **kwargs)
+            tic = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                seconds = time.perf_counter() - tic
+                with self._lock:
+                    stage.n_sampled += 1
+                    stage.sampled_seconds += seconds
+
+        return timed_func
+
+    def install(self):
+        """Replace the hooks and the persister of the store with timed versions"""
+        if self._originals is not None:
+            return
+        store = self.store
+        persister_attr = 'persister' if 'persister' in store.__dict__ else 'store'
+        self._originals = {attr: store.__dict__.get(attr) for attr in HOOKS + (persister_attr,)}
+        for hook in HOOKS:
+            setattr(store, hook, self.timed(hook, getattr(store, hook)))
+        setattr(store, persister_attr, TracedPersister(getattr(store, persister_attr), self))
+
+    def uninstall(self):
+        """Put the original hooks and persister back (and remove the store's pipeline_tracer, if it's this tracer,
+        since its lock would keep the store from pickling)"""
+        self._restore_originals()
+        if self.store.__dict__.get('pipeline_tracer') is self:
+            del self.store.pipeline_tracer
+
+    def _restore_originals(self):
+        if self._originals is None:
+            return
+        for attr, original in self._originals.items():
+            if original is None:  # it wasn't an instance attribute (but a class one, as in py2store.kv)
+                delattr(self.store, attr)
+            else:
+                setattr(self.store, attr, original)
+        self._originals = None
+
+    def reset(self):
+        with self._lock:
+            self.stages = {name: StageStats() for name in self.stages}
+        if self._originals is not None:  # the timed functions hold the old stages: make new ones
+            self._restore_originals()
+            self.install()
+
+    def breakdown(self):
+        """A list of {stage, calls, sampled, mean_seconds, est_seconds, percent} rows, most time consuming first"""
+        rows = []
+        with self._lock:
+            for name, stage in self.stages.items():
+                n_calls = stage.n_calls
+                if not n_calls:
+                    continue
+                mean = stage.sampled_seconds / stage.n_sampled if stage.n_sampled else 0.0
+                rows.append(dict(stage=name, calls=n_calls, sampled=stage.n_sampled, mean_seconds=mean,
+                                 est_seconds=mean * n_calls))
+        total = sum(row['est_seconds'] for row in rows)
+        for row in rows:
+            row['percent'] = 100 * row['est_seconds'] / total if total else 0.0
+        return sorted(rows, key=lambda row: -row['est_seconds'])
+
+    def table(self):
+        """The breakdown, as a printable table"""
+        lines = [f"{'stage':<22}{'calls':>10}{'sampled':>10}{'mean (us)':>12}{'total (s)':>12}{'%':>8}"]
+        for row in self.breakdown():
+            lines.append(f"{row['stage']:<22}{row['calls']:>10}{row['sampled']:>10}{row['mean_seconds'] * 1e6:>12.2f}"
+                         f"{row['est_seconds']:>12.4f}{row['percent']:>8.1f}")
+        return '\n'.join(lines)
+
+
+class TracedPersister(Persister):
+    """A wrapper of a persister whose operations are timed (as 'persister.<operation>' stages) by a PipelineTracer"""
+
+    def __init__(self, persister, tracer):
+        self.persister = persister
+        self._getitem = tracer.timed('persister.get', persister.__getitem__)
+        self._setitem = tracer.timed('persister.set', persister.__setitem__)
+        self._delitem = tracer.timed('persister.delete', persister.__delitem__)
+        self._contains = tracer.timed('persister.contains', persister.__contains__)
+        self._list = tracer.timed('persister.iter', lambda: list(persister))
+        for method in ('getmany', 'setmany', 'delmany'):
+            if hasattr(persister, method):
+                setattr(self, method, tracer.timed(f'persister.{method}', getattr(persister, method)))
+
+    def __getitem__(self, k):
+        return self._getitem(k)
+
+    def __setitem__(self, k, v):
+        self._setitem(k, v)
+
+    def __delitem__(self, k):
+        self._delitem(k)
+
+    def __contains__(self, k):
+        return self._contains(k)
+
+    def __iter__(self):  # (the listing is timed as a whole, so it's made as a whole)
+        return iter(self._list())
+
+    def __len__(self):
+        return len(self.persister)
+
+    def __getattr__(self, attr):
+        if attr == 'persister':
+            raise AttributeError(attr)
+        return getattr(self.persister, attr)
+
+
+def trace_pipeline(store, sample_every=1):
+    """Make a PipelineTracer for store, install it, and return it (it's also the store's pipeline_tracer attribute).
+    Call its table() method to see where the store's time goes, and its uninstall() method to stop tracing."""
+    tracer = PipelineTracer(store, sample_every=sample_every)
+    tracer.install()
+    store.pipeline_tracer = tracer
+    return tracer
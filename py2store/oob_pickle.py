@@ -0,0 +1,77 @@
+"""
+Pickling with out-of-band buffers (pickle protocol 5), so that big buffers (of numpy arrays, for instance) are
+unpickled as views of the data (a memory map of a file, for instance), without being copied.
+"""
+
+import pickle
+import struct
+
+OOB_PICKLE_MAGIC = b'OOB5'
+DFLT_MIN_OOB_BYTES = 64 * 1024
+DFLT_OOB_ALIGNMENT = 64
+_oob_header = struct.Struct('<4sIQ')  # magic, number of buffers, length of the pickle
+_oob_buffer_header = struct.Struct('<QQ')  # offset, length
+
+
+class OutOfBandPickleValWrap:
+    """A val wrap that pickles with protocol 5, writing the big buffers of objects (e.g. numpy arrays) out-of-band:
+    Not inside the pickle stream, but after it, each starting at an offset that's a multiple of alignment.
+    When unpickling, these buffers are given to pickle as views of the data, so that (numpy) objects are
+    reconstructed over the data, without copying it. Combined with a memory mapped read of the data
+    (see SimpleFilePersister's mode='m'), big arrays are never copied at all.
+    Note that the objects reconstructed over immutable data (like bytes or a read-only memory map) are read-only.
+
+    Buffers smaller than min_oob_bytes are pickled in-band, and data that wasn't written by this val wrap
+    (i.e. plain pickles) is unpickled normally.
+
+    >>> val_wrap = OutOfBandPickleValWrap(min_oob_bytes=10)
+    >>> obj = {'small': bytearray(b'12345'), 'big': bytearray(b'0123456789' * 10)}
+    >>> data = val_wrap._data_of_obj(obj)
+    >>> data[:4]
+    b'OOB5'
+    >>> val_wrap._obj_of_data(data) == obj
+    True
+    >>> val_wrap._obj_of_data(pickle.dumps(obj)) == obj  # plain pickles still work
+    True
+    """
+
+    def __init__(self, min_oob_bytes=DFLT_MIN_OOB_BYTES, alignment=DFLT_OOB_ALIGNMENT, fix_imports=True):
+        self.min_oob_bytes = min_oob_bytes
+        self.alignment = alignment
+        self.fix_imports = fix_imports
+
+    def _padding(self, offset):
+        return -offset % self.alignment
+
+    def _data_of_obj(self, v):
+        buffers = []
+
+        def buffer_callback(buffer):
+            raw = buffer.raw()
+            if raw.nbytes < self.min_oob_bytes:
+                return True  # pickle it in-band
+            buffers.append(raw)
+
+        pickle_bytes = pickle.dumps(v, protocol=5, fix_imports=self.fix_imports, buffer_callback=buffer_callback)
+        offset = _oob_header.size + _oob_buffer_header.size * len(buffers) + len(pickle_bytes)
+        buffer_headers, chunks = [], []
+        for raw in buffers:
+            padding = self._padding(offset)
+            chunks += [b'\0' * padding, raw]
+            buffer_headers.append(_oob_buffer_header.pack(offset + padding, raw.nbytes))
+            offset += padding + raw.nbytes
+        header = _oob_header.pack(OOB_PICKLE_MAGIC, len(buffers), len(pickle_bytes))
+        return b''.join([header, *buffer_headers, pickle_bytes, *chunks])
+
+    def _obj_of_data(self, v):
+        data = memoryview(v)
+        if data[:len(OOB_PICKLE_MAGIC)] != OOB_PICKLE_MAGIC:
+            return pickle.loads(v, fix_imports=self.fix_imports)
+        _, n_buffers, pickle_length = _oob_header.unpack_from(data)
+        pos = _oob_header.size
+        buffers = []
+        for _ in range(n_buffers):
+            offset, length = _oob_buffer_header.unpack_from(data, pos)
+            buffers.append(data[offset:offset + length])
+            pos += _oob_buffer_header.size
+        return pickle.loads(data[pos:pos + pickle_length], fix_imports=self.fix_imports, buffers=buffers)
@@ -0,0 +1,105 @@
+"""
+Parallel map (and reduce) over the contents of a store, with a pool of processes.
+
+The usual
+    for k, v in store.items():
+        results[k] = func(v)
+uses a single core, and reads everything in a single process. With store_map, the work is spread over a pool of
+worker processes, and only keys are sent to them: Each worker opens its own instance of the store (and of the target
+store, if results are written to one), so values are read (and results written) in the workers, never pickled across
+processes.
+
+A worker gets its store either by unpickling the store given (the stores of py2store.simple and py2store.kv pickle,
+as long as their persister and hooks do: local file stores do, S3 stores don't), or by calling store_factory, a
+picklable callable (e.g. a functools.partial of the store's class, with its arguments) that makes one.
+
+The func (and reduce) must be picklable (module level functions, not lambdas), as for any process pool.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial, reduce as functools_reduce
+
+from py2misc.py2store.simple import identity_func
+from py2misc.py2store.concurrency import imap_ordered, imap_unordered, chunks
+
+DFLT_CHUNKSIZE = 64  # number of keys sent to a worker at a time
+_no_initial = object()
+
+# The stores of a worker process (set by _init_worker)
+_worker_store = None
+_worker_target = None
+
+
+def _init_worker(make_store, make_target):
+    global _worker_store, _worker_target
+    _worker_store = make_store()
+    _worker_target = make_target() if make_target is not None else None
+
+
+def _map_chunk(func, keys):
+    """(In a worker) The [(k, func(store[k])), ...] of keys, or, if there's a target, write the results to it"""
+    if _worker_target is None:
+        return [(k, func(_worker_store[k])) for k in keys]
+    for k in keys:
+        _worker_target[k] = func(_worker_store[k])
+    return [(k, None) for k in keys]
+
+
+def _store_maker(store, store_factory):
+    if store_factory is not None:
+        return store_factory
+    return partial(identity_func, store)  # (a picklable callable that returns the (unpickled) store)
+
+
+def store_imap(store, func, workers=None, chunksize=DFLT_CHUNKSIZE, keys=None, ordered=True,
+               store_factory=None, target=None, target_factory=None):
+    """Yield the (k, func(store[k])) pairs of keys (all keys of store, by default), computed by workers processes
+    (os.cpu_count() if None), each given chunksize keys at a time.
+    If ordered, pairs are yielded in the order of keys. If not, in the order they're computed (which keeps the pool
+    busy even when some values take much longer than others).
+    If target (or target_factory) is given, the workers write func(store[k]) to target[k], and (k, None) is yielded.
+    With workers=0, everything is done in the current process (handy for debugging).
+    Keys are listed (and sent) as the workers need them, so at most (about) 2 * workers chunks are in flight.
+    """
+    keys = iter(store) if keys is None else keys
+    make_store = _store_maker(store, store_factory)
+    make_target = None if target is None and target_factory is None else _store_maker(target, target_factory)
+    if workers == 0:
+        _init_worker(make_store, make_target)
+        for chunk in chunks(keys, chunksize):
+            yield from _map_chunk(func, chunk)
+        return
+    workers = workers or os.cpu_count()
+    imap = imap_ordered if ordered else imap_unordered
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(make_store, make_target)) as executor:
+        for chunk_result in imap(partial(_map_chunk, func), chunks(keys, chunksize), executor, n_ahead=2 * workers):
+            yield from chunk_result
+
+
+def store_map(store, func, workers=None, chunksize=DFLT_CHUNKSIZE, keys=None, ordered=True, reduce=None,
+              initial=_no_initial, store_factory=None, target=None, target_factory=None):
+    """Apply func to the values of store (or of keys only), in a pool of workers processes (see store_imap).
+
+    Returns:
+        - if target (or target_factory) is given: the number of results written to the target (by the workers),
+        - if reduce is given: reduce(reduce, results, initial) (the reduction is made in this process, as the results
+          come in, so with ordered=False, reduce should be associative and commutative),
+        - if not: a {k: func(store[k]), ...} dict (in the order of keys, if ordered).
+
+    For example, with a module level
+        def n_samples(wf):
+            return len(wf)
+    store_map(PickleFileStore(rootdir), n_samples, reduce=operator.add) is the total number of samples of the
+    (pickled) waveforms under rootdir, computed by all cores.
+    """
+    pairs = store_imap(store, func, workers=workers, chunksize=chunksize, keys=keys, ordered=ordered,
+                       store_factory=store_factory, target=target, target_factory=target_factory)
+    if target is not None or target_factory is not None:
+        return sum(1 for _ in pairs)
+    if reduce is not None:
+        results = (result for _, result in pairs)
+        if initial is _no_initial:
+            return functools_reduce(reduce, results)
+        return functools_reduce(reduce, results, initial)
+    return dict(pairs)
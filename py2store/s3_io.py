@@ -0,0 +1,230 @@
+"""
+S3 input and output, through a (thread safe) boto3 client: Paginated (and cached) listings of keys, ranged reads, and
+streaming reads and (multipart) writes of objects.
+"""
+
+import io
+import time
+from heapq import merge
+from threading import Lock
+
+from botocore.exceptions import ClientError
+
+from py2misc.py2store.streams import check_open_mode
+
+class NoSuchKeyError(KeyError):
+    pass
+
+
+S3_DELETE_OBJECTS_MAX_KEYS = 1000  # the maximum number of keys a single delete_objects request accepts
+
+
+DFLT_S3_PAGE_SIZE = 1000  # the maximum number of keys a single list_objects_v2 request returns
+
+
+def iter_s3_keys(client, bucket_name, prefix='', delimiter=None, page_size=DFLT_S3_PAGE_SIZE, start_after=None):
+    """Yield the keys (strings) of bucket_name that start with prefix, in lexicographic order, one list_objects_v2
+    page (of at most page_size keys) at a time.
+    With a delimiter (e.g. '/'), keys are only listed up to the first delimiter after prefix: Keys that have one are
+    rolled up to a single (directory-like) key, ending with delimiter, that is listed instead of them.
+    If start_after is given, the listing starts (S3 side) after that key.
+    """
+    kwargs = dict(Bucket=bucket_name, Prefix=prefix, MaxKeys=page_size)
+    if delimiter:
+        kwargs['Delimiter'] = delimiter
+    if start_after:
+        kwargs['StartAfter'] = start_after
+    while True:
+        response = client.list_objects_v2(**kwargs)
+        yield from merge((obj['Key'] for obj in response.get('Contents', ())),
+                         (common_prefix['Prefix'] for common_prefix in response.get('CommonPrefixes', ())))
+        if not response.get('IsTruncated'):
+            break
+        kwargs['ContinuationToken'] = response['NextContinuationToken']
+
+
+class S3ListingCache:
+    """Keeps the listings (of iter_s3_keys) for ttl seconds.
+    Meant to avoid listing the same prefix over and over again, in a job that doesn't need to see changes made (by
+    others) in the meantime. The owner of the cache should clear() it when it writes or deletes keys.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._listings = {}  # (prefix, delimiter) -> (expiry time, keys)
+        self._lock = Lock()
+
+    def get(self, list_keys, prefix='', delimiter=None):
+        """The keys list_keys(prefix, delimiter) returns, listed less than ttl seconds ago"""
+        now = time.monotonic()
+        with self._lock:
+            expiry, keys = self._listings.get((prefix, delimiter), (0, None))
+        if now >= expiry:
+            keys = list(list_keys(prefix, delimiter))
+            with self._lock:
+                self._listings[prefix, delimiter] = (now + self.ttl, keys)
+        return keys
+
+    def clear(self):
+        with self._lock:
+            self._listings.clear()
+
+
+DFLT_S3_MULTIPART_THRESHOLD = 64 * 1024 ** 2  # values at least this big are uploaded in (concurrent) parts
+DFLT_S3_MULTIPART_CHUNKSIZE = 16 * 1024 ** 2
+S3_MULTIPART_MIN_CHUNKSIZE = 5 * 1024 ** 2  # S3's minimum size for all but the last part
+S3_MULTIPART_MAX_PARTS = 10000
+DFLT_S3_PART_ATTEMPTS = 3
+
+
+def s3_range_header(start=0, stop=None):
+    """The (http) Range header value for the bytes start:stop (as in a python slice, but with no step, and only
+    start can be negative, with stop=None, for the last -start bytes).
+
+    >>> s3_range_header(10, 20), s3_range_header(10), s3_range_header(-100)
+    ('bytes=10-19', 'bytes=10-', 'bytes=-100')
+    """
+    if start < 0:
+        assert stop is None, "A negative start (the last -start bytes) can only be used with stop=None"
+        return f'bytes={start}'
+    if stop is None:
+        return f'bytes={start}-'
+    assert stop > start, f"stop ({stop}) must be greater than start ({start})"
+    return f'bytes={start}-{stop - 1}'
+
+
+def s3_upload_part(client, bucket_name, key, upload_id, part_number, data, attempts=DFLT_S3_PART_ATTEMPTS):
+    """Upload a part of a multipart upload (trying up to attempts times), and return its {'PartNumber', 'ETag'}"""
+    for attempt in range(1, attempts + 1):
+        try:
+            response = client.upload_part(Bucket=bucket_name, Key=key, UploadId=upload_id,
+                                          PartNumber=part_number, Body=data)
+            return {'PartNumber': part_number, 'ETag': response['ETag']}
+        except ClientError:
+            if attempt == attempts:
+                raise
+
+
+class S3StreamingBodyReader(io.RawIOBase):
+    """A raw (unbuffered) reader of a (botocore) StreamingBody. Wrap it in an io.BufferedReader."""
+
+    def __init__(self, body):
+        self._body = body
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        data = self._body.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self._body.close()
+        super().close()
+
+
+class S3MultipartWriter(io.BufferedIOBase):
+    """A writer of an S3 object that uploads the data in parts of chunksize bytes as it's written, so only (about) a
+    chunk is held in memory at any time (each part is tried up to part_attempts times). The upload is completed when
+    the writer is closed. Data that fits in a single chunk is uploaded with a single put_object instead.
+    If the writer is used as a context manager, and the with block raises, the upload is aborted (nothing is written).
+    on_close is called (without arguments) once the object is written.
+    """
+
+    def __init__(self, client, bucket_name, key, chunksize=DFLT_S3_MULTIPART_CHUNKSIZE, on_close=None,
+                 part_attempts=DFLT_S3_PART_ATTEMPTS):
+        self._client = client
+        self.bucket_name = bucket_name
+        self.key = key
+        self.chunksize = max(chunksize, S3_MULTIPART_MIN_CHUNKSIZE)
+        self.part_attempts = part_attempts
+        self._on_close = on_close
+        self._buffer = bytearray()
+        self._upload_id = None
+        self._parts = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        if self.closed:
+            raise ValueError("write to closed file")
+        self._buffer += b
+        while len(self._buffer) >= self.chunksize:
+            self._upload_part(bytes(self._buffer[:self.chunksize]))
+            del self._buffer[:self.chunksize]
+        return len(b)
+
+    def _upload_part(self, data):
+        if self._upload_id is None:
+            self._upload_id = self._client.create_multipart_upload(
+                Bucket=self.bucket_name, Key=self.key)['UploadId']
+        self._parts.append(s3_upload_part(self._client, self.bucket_name, self.key, self._upload_id,
+                                          len(self._parts) + 1, data, self.part_attempts))
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self._upload_id is None:
+                self._client.put_object(Bucket=self.bucket_name, Key=self.key, Body=bytes(self._buffer))
+            else:
+                if self._buffer:
+                    self._upload_part(bytes(self._buffer))
+                self._client.complete_multipart_upload(Bucket=self.bucket_name, Key=self.key,
+                                                       UploadId=self._upload_id,
+                                                       MultipartUpload={'Parts': self._parts})
+        except BaseException:
+            self.abort()
+            raise
+        finally:
+            self._buffer = bytearray()
+            super().close()
+        if self._on_close is not None:
+            self._on_close()
+
+    def abort(self):
+        """Drop what was written (and the parts uploaded so far), and close"""
+        if self._upload_id is not None:
+            self._client.abort_multipart_upload(Bucket=self.bucket_name, Key=self.key, UploadId=self._upload_id)
+            self._upload_id = None
+        self._buffer = bytearray()
+        if not self.closed:
+            super().close()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+
+def open_s3_object(client, bucket_name, key, mode='rb', chunksize=DFLT_S3_MULTIPART_CHUNKSIZE, on_close=None,
+                   encoding='utf-8'):
+    """A file-like object to stream the data of an S3 object: A buffered reader of its body (in 'rb' mode),
+    or an S3MultipartWriter (in 'wb' mode). In text modes ('r', 'w'), these are wrapped in an io.TextIOWrapper."""
+    check_open_mode(mode)
+    if mode.startswith('r'):
+        try:
+            body = client.get_object(Bucket=bucket_name, Key=key)['Body']
+        except ClientError as e:
+            if e.response['Error']['Code'] in ("404", "NoSuchKey"):
+                raise NoSuchKeyError(f"Key wasn't found: {key}")
+            raise
+        f = io.BufferedReader(S3StreamingBodyReader(body))
+    else:
+        f = S3MultipartWriter(client, bucket_name, key, chunksize, on_close)
+    if 'b' not in mode:
+        f = io.TextIOWrapper(f, encoding=encoding)
+    return f
+
+
+def s3_key_of(k):
+    """The (string) key of k, which can be a string, or a boto3 s3.Object"""
+    return k if isinstance(k, str) else k.key
+
+
+def is_missing_key_error(e):
+    return e.response['Error']['Code'] in ("404", "NoSuchKey")
@@ -13,6 +13,10 @@ The main classes to check out are:
 And just to show something a bit more complex, we also include:
 * S3Store: Like SimpleFileStore, but stores data in an AWS S3 bucket.
 
+The machinery behind the stores' options lives in modules of its own: streams (file-like objects on values),
+concurrency (lazy concurrent maps), durability (fsyncs and group commits), file_index, file_sharding and sorted_keys
+(listings of keys), oob_pickle (out-of-band pickling) and s3_io (S3 listings, ranged reads and multipart uploads).
+
 pytest included
 
 """
@@ -21,6 +25,21 @@ pytest included
 # Base classes
 from collections.abc import MutableMapping
 
+from py2misc.py2store.streams import open_in_memory, CallOnClose
+from py2misc.py2store.concurrency import DFLT_MAX_WORKERS, imap_ordered, chunks
+
+
+def items_of(items):
+    """Get a (key, val) pairs iterable from either a Mapping or an iterable of pairs"""
+    if hasattr(items, 'items'):
+        return items.items()
+    return items
+
+
+def identity_func(x):
+    """The identity function. Stores recognize it (with `is`) as a hook that doesn't need to be called."""
+    return x
+
 
 class Persister(MutableMapping):
     """ Interface for a StoreBase
@@ -44,8 +63,278 @@ class Persister(MutableMapping):
             except KeyError:
                 pass''')
 
+    # Bulk operations: Per-key fallbacks. Persisters that have a faster bulk path should override these.
+    def getmany(self, keys):
+        return [self[k] for k in keys]
+
+    def setmany(self, items):
+        for k, v in items_of(items):
+            self[k] = v
+
+    def delmany(self, keys):
+        for k in keys:
+            del self[k]
+
+    # Streaming: An in-memory fallback. Persisters that can stream (files, S3...) should override this.
+    def open(self, k, mode='rb'):
+        """A file-like object to read ('r', 'rb') or write ('w', 'wb') the value of k.
+        This fallback reads the whole value in memory, and writes it (whole) when the file is closed."""
+        return open_in_memory(self, k, mode)
+
+
+# Bulk operations (and streaming) on any MutableMapping: With its own method if it has one, a per-key loop if not
+def getmany_of(mapping, keys):
+    """The values of keys in mapping, as a list aligned with keys"""
+    getmany = getattr(mapping, 'getmany', None)
+    if getmany is not None:
+        return list(getmany(keys))
+    return [mapping[k] for k in keys]
+
+
+def setmany_of(mapping, items):
+    """Write items (a Mapping or an iterable of (k, v) pairs) to mapping"""
+    setmany = getattr(mapping, 'setmany', None)
+    if setmany is not None:
+        return setmany(items)
+    for k, v in items_of(items):
+        mapping[k] = v
+
+
+def delmany_of(mapping, keys):
+    """Delete keys from mapping"""
+    delmany = getattr(mapping, 'delmany', None)
+    if delmany is not None:
+        return delmany(keys)
+    for k in keys:
+        del mapping[k]
+
+
+def open_of(mapping, k, mode='rb'):
+    """A file-like object on the value of k in mapping: mapping.open(k, mode) if it has an open, or open_in_memory"""
+    mapping_open = getattr(mapping, 'open', None)
+    if mapping_open is not None:
+        return mapping_open(k, mode)
+    return open_in_memory(mapping, k, mode)
+
+
+class KeyCountMixin:
+    """A Persister (or kv.StoreBase) mixin that maintains a count of keys, so that __len__ doesn't have to list (and
+    count) all keys.
+
+    The count is taken (by listing keys) the first time it's asked for, and then kept up to date by the writes and
+    deletes made through the instance (a write only counts if the key didn't already exist).
+    Writes and deletes made through other means (other processes, other instances...) will not be accounted for:
+    Call resync_len to recount.
+    Don't use it for persisters (or stores) that already know their size (like dict-based ones).
+    """
+
+    _key_count = None
+
+    def __len__(self):
+        if self._key_count is None:
+            return self.resync_len()
+        return self._key_count
+
+    def resync_len(self):
+        """Recount the keys (by listing them all), and return the new count"""
+        self._key_count = super().__len__()
+        return self._key_count
+
+    def __setitem__(self, k, v):
+        is_new_key = self._key_count is not None and not self.__contains__(k)
+        super().__setitem__(k, v)
+        if is_new_key:
+            self._key_count += 1
+
+    def __delitem__(self, k):
+        super().__delitem__(k)
+        if self._key_count is not None:
+            self._key_count -= 1
+
+    # The count is suspended (None) during bulk operations, so that the per-key writes (or deletes) they may fall back
+    # to aren't counted twice. If they fail, it stays None, so it will be recounted.
+    def setmany(self, items):
+        items = list(items_of(items))
+        key_count, self._key_count = self._key_count, None
+        if key_count is not None:
+            key_count += sum(not self.__contains__(k) for k in {k for k, _ in items})
+        super().setmany(items)
+        self._key_count = key_count
+
+    def delmany(self, keys):
+        keys = list(keys)
+        key_count, self._key_count = self._key_count, None
+        if key_count is not None:  # (repeated keys are deleted once, and missing ones not at all)
+            key_count -= sum(self.__contains__(k) for k in set(keys))
+        super().delmany(keys)
+        self._key_count = key_count
+
+    def open(self, k, mode='rb'):
+        is_new_key = mode.startswith('w') and self._key_count is not None and not self.__contains__(k)
+        f = super().open(k, mode)
+        if is_new_key:
+            return CallOnClose(f, self._count_new_key)  # counted once it's written: when the file is closed
+        return f
+
+    def _count_new_key(self):
+        if self._key_count is not None:
+            self._key_count += 1
+
+
+STORE_HOOKS = ('_id_of_key', '_key_of_id', '_data_of_obj', '_obj_of_data')
+SPECIALIZED_ATTRS = ('_getitem', '_setitem', '_delitem', '_contains', '_iter')  # (bound by Store._specialize)
+DFLT_PREFETCH_WORKERS = 8
+
+
+def specialized_store_methods(backend, id_of_key, key_of_id, data_of_obj, obj_of_data):
+    """The read (_getitem), write (_setitem), delete (_delitem), containment (_contains) and listing (_iter) functions
+    of a store over backend (a MutableMapping), calling only the hooks that aren't identity_func.
+    Returned as a dict keyed by SPECIALIZED_ATTRS, for the store to put in its __dict__."""
+    d = {}
+    if id_of_key is identity_func:
+        d['_delitem'] = backend.__delitem__
+        d['_contains'] = backend.__contains__
+        if obj_of_data is identity_func:
+            d['_getitem'] = backend.__getitem__
+        else:
+            d['_getitem'] = lambda k: obj_of_data(backend[k])
+        if data_of_obj is identity_func:
+            d['_setitem'] = backend.__setitem__
+        else:
+            d['_setitem'] = lambda k, v: backend.__setitem__(k, data_of_obj(v))
+    else:
+        d['_delitem'] = lambda k: backend.__delitem__(id_of_key(k))
+        d['_contains'] = lambda k: backend.__contains__(id_of_key(k))
+        if obj_of_data is identity_func:
+            d['_getitem'] = lambda k: backend[id_of_key(k)]
+        else:
+            d['_getitem'] = lambda k: obj_of_data(backend[id_of_key(k)])
+        if data_of_obj is identity_func:
+            d['_setitem'] = lambda k, v: backend.__setitem__(id_of_key(k), v)
+        else:
+            d['_setitem'] = lambda k, v: backend.__setitem__(id_of_key(k), data_of_obj(v))
+    if key_of_id is identity_func:
+        d['_iter'] = backend.__iter__
+    else:
+        d['_iter'] = lambda: map(key_of_id, backend.__iter__())
+    return d
+
 
-class Store:
+class SpecializedPicklingMixin:
+    """Pickling for stores with specialized methods (see specialized_store_methods): Those are closures (that can't
+    be pickled), so they're left out of the pickled state, and rebound (by the store's _specialize) when unpickling."""
+
+    def __getstate__(self):
+        return {attr: val for attr, val in self.__dict__.items() if attr not in SPECIALIZED_ATTRS}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._specialize()
+
+
+class StoreMethodsMixin:
+    """The methods that the stores of py2store.simple and py2store.kv share, beyond those of a MutableMapping:
+    filtered (and sorted) keys, prefetched items, bulk operations, streaming and metadata.
+    They apply the store's hooks (see Store), and delegate to its _backend: its persister (or, in py2store.kv, store).
+    """
+
+    def keys(self, prefix=None, start=None, stop=None):
+        """The keys that start with prefix and/or are in the [start, stop) range, in sorted order.
+
+        >>> from py2misc.py2store.sorted_keys import SortedKeysPersister
+        >>> s = Store(SortedKeysPersister(dict()))
+        >>> for k in ['s2/1', 's1/2', 's1/1', 's10/1']:
+        ...     s[k] = 'data'
+        >>> list(s.keys(prefix='s1/'))
+        ['s1/1', 's1/2']
+        >>> list(s.keys(start='s10', stop='s2/1'))
+        ['s10/1']
+        """
+        if prefix is None and start is None and stop is None:
+            return iter(self)
+        ids = self._iter_sorted_ids(prefix, start, stop)
+        if ids is not None:
+            return map(self._key_of_id, ids)
+        return iter(sorted(k for k in self if _key_is_in(k, prefix, start, stop)))
+
+    def _iter_sorted_ids(self, prefix, start, stop):
+        """The sorted ids of the keys(prefix, start, stop), if the backend (and _id_of_key_prefix) can list them"""
+        translate = self._id_of_key_prefix
+        if translate is None:
+            return None
+        start_id, stop_id = (None if x is None else translate(x) for x in (start, stop))
+        if prefix is not None and hasattr(self._backend, 'iter_prefix'):
+            ids = self._backend.iter_prefix(translate(prefix))
+            if start is None and stop is None:
+                return ids
+            return (_id for _id in ids if _key_is_in(_id, None, start_id, stop_id))
+        if hasattr(self._backend, 'iter_range'):
+            ids = self._backend.iter_range(start_id, stop_id)
+            if prefix is None:
+                return ids
+            return (_id for _id in ids if _id.startswith(translate(prefix)))
+
+    def prefetch_items(self, n_ahead=None, workers=DFLT_PREFETCH_WORKERS):
+        """Iterate over the (k, v) items of the store, in key order, while the values of the next n_ahead keys
+        (2 * workers by default) are read (and deserialized) in the background, by workers threads.
+        So the caller's processing of an item overlaps the reading of the next ones: Scans of stores with slow reads
+        (files, S3...) are limited by throughput, not latency.
+        At most n_ahead values are held (read, but not yet yielded) at any time. If reading a value fails, the error
+        is raised when its item is reached (the items before it are yielded normally).
+        Stopping early (break, close) cancels the reads that haven't started.
+
+        >>> s = Store()
+        >>> s.setmany({'a': 1, 'b': 2, 'c': 3})
+        >>> list(s.prefetch_items(n_ahead=2, workers=2))
+        [('a', 1), ('b', 2), ('c', 3)]
+        """
+        if n_ahead is None:
+            n_ahead = 2 * workers
+        with ThreadPoolExecutor(workers) as executor:
+            yield from imap_ordered(lambda k: (k, self[k]), iter(self), executor, n_ahead=n_ahead)
+
+    # Bulk operations ##################################################################################################
+    def getmany(self, keys):
+        """Get the values of keys, as a list aligned with keys"""
+        return list(map(self._obj_of_data, getmany_of(self._backend, list(map(self._id_of_key, keys)))))
+
+    def setmany(self, items):
+        """Write several items at once. items can be a Mapping or an iterable of (k, v) pairs"""
+        setmany_of(self._backend, [(self._id_of_key(k), self._data_of_obj(v)) for k, v in items_of(items)])
+
+    def delmany(self, keys):
+        """Delete several keys at once"""
+        delmany_of(self._backend, list(map(self._id_of_key, keys)))
+
+    # Streaming ########################################################################################################
+    def open(self, k, mode='rb'):
+        """A file-like object to read ('r', 'rb') or write ('w', 'wb') the data of k, in a streaming fashion if the
+        backend can (if it has an open method), or in memory if not.
+        Only the key transform applies: The data is read and written as the backend stores it (_obj_of_data and
+        _data_of_obj are not applied).
+
+        >>> s = Store()
+        >>> with s.open('greeting', 'w') as f:
+        ...     _ = f.write('hello ')
+        ...     _ = f.write('world')
+        >>> s['greeting']
+        'hello world'
+        >>> with s.open('greeting', 'r') as f:
+        ...     f.read(5)
+        'hello'
+        """
+        return open_of(self._backend, self._id_of_key(k), mode)
+
+    def meta(self, k):
+        """The metadata of the (stored) data of k, as a dict, if the backend has a meta method (the size, in bytes,
+        and when available the 'mtime' and 'etag' of the data), or None if it doesn't.
+        Raises a KeyError if there's no k."""
+        backend_meta = getattr(self._backend, 'meta', None)
+        if backend_meta is not None:
+            return backend_meta(self._id_of_key(k))
+
+
+class Store(SpecializedPicklingMixin, StoreMethodsMixin):
     """
     By store we mean key-value store. This could be files in a filesystem, objects in s3, or a database. Where and
     how the content is stored should be specified, but StoreInterface offers a dict-like interface to this.
@@ -54,39 +343,77 @@ class Store:
     __setitem__ calls: _id_of_key		        _data_of_obj
     __delitem__ calls: _id_of_key
     __iter__    calls:	            _key_of_id
+
+    getmany, setmany and delmany do the same for a batch of keys, applying each transform over the whole batch,
+    and using the persister's bulk methods (if it has them) instead of a per-key loop.
+
+    keys(prefix=...) and keys(start=..., stop=...) list keys in sorted order. If the persister has a sorted index of
+    its ids (see py2store.sorted_keys) they're served by it, provided _id_of_key_prefix says how key prefixes (and
+    bounds) translate to ids: It must preserve prefixes and order (as PrefixRelativization._id_of_key_prefix does).
+    If it's not given, it's identity_func when _id_of_key is, and None (no translation) when it's not.
+    Without a sorted index or a translation, all keys are listed, filtered and sorted.
+
+    Hooks that are identity_func (the default) are skipped: The read, write and listing paths are specialized (see
+    _specialize) when the store is made, and again whenever a hook (or the persister) is (re)assigned.
+    So with no transforms, store[k] is (nearly) as fast as persister[k].
     """
 
     def __init__(self,
                  persister=None,
-                 _id_of_key=lambda x: x,
-                 _key_of_id=lambda x: x,
-                 _data_of_obj=lambda x: x,
-                 _obj_of_data=lambda x: x):
+                 _id_of_key=identity_func,
+                 _key_of_id=identity_func,
+                 _data_of_obj=identity_func,
+                 _obj_of_data=identity_func,
+                 _id_of_key_prefix=None):
         if persister is None:
             persister = dict()
+        if _id_of_key_prefix is None and _id_of_key is identity_func:
+            _id_of_key_prefix = identity_func  # keys are ids, so key prefixes (and bounds) are id prefixes
         self.persister = persister
         self._id_of_key = _id_of_key
         self._key_of_id = _key_of_id
         self._data_of_obj = _data_of_obj
         self._obj_of_data = _obj_of_data
+        self._id_of_key_prefix = _id_of_key_prefix
+        self._specialize()
+
+    def __setattr__(self, attr, val):
+        super().__setattr__(attr, val)
+        if (attr in STORE_HOOKS or attr == 'persister') and '_getitem' in self.__dict__:
+            self._specialize()
+
+    def _specialize(self):
+        """Bind the functions that the dunders delegate to (see specialized_store_methods)"""
+        self.__dict__.update(specialized_store_methods(  # (not setattr, which would re-specialize)
+            self.persister, self._id_of_key, self._key_of_id, self._data_of_obj, self._obj_of_data))
+
+    @property
+    def _backend(self):  # (see StoreMethodsMixin)
+        return self.persister
 
     def __getitem__(self, k):
-        return self._obj_of_data(self.persister.__getitem__(self._id_of_key(k)))
+        return self._getitem(k)
 
     def __setitem__(self, k, v):
-        return self.persister.__setitem__(self._id_of_key(k), self._data_of_obj(v))
+        return self._setitem(k, v)
 
     def __delitem__(self, k):
-        return self.persister.__delitem__(self._id_of_key(k))
+        return self._delitem(k)
 
     def __iter__(self):
-        return map(self._key_of_id, self.persister.__iter__())
+        return self._iter()
 
     def __len__(self):
         return self.persister.__len__()
 
     def __contains__(self, k):
-        return self.persister.__contains__(self._id_of_key(k))
+        return self._contains(k)
+
+
+def _key_is_in(k, prefix=None, start=None, stop=None):
+    return ((prefix is None or k.startswith(prefix))
+            and (start is None or k >= start)
+            and (stop is None or k < stop))
 
 
 ########################################################################################################################
@@ -115,9 +442,15 @@ class PrefixRelativization:
     def _key_of_id(self, _id):
         return _id[self._prefix_length:]
 
+    def _id_of_key_prefix(self, prefix):
+        """The prefix of the ids of the keys that start with prefix (also works for range bounds: order is kept)"""
+        return self._prefix + prefix
+
 
 import pickle
 
+from py2misc.py2store.oob_pickle import OutOfBandPickleValWrap
+
 
 class PickleValWrap:
     """A val wrap that serializes by pickling objects."""
@@ -133,6 +466,12 @@ class PickleValWrap:
         return pickle.loads(v, fix_imports=self.fix_imports)
 
 
+def _pickle_val_wrap(protocol=None, fix_imports=True, out_of_band=False):
+    if out_of_band:
+        return OutOfBandPickleValWrap(fix_imports=fix_imports)
+    return PickleValWrap(protocol=protocol, fix_imports=fix_imports)
+
+
 ########################################################################################################################
 ########################################################################################################################
 # Dict store
@@ -141,17 +480,32 @@ from collections import UserDict
 
 
 class DictPersister(Persister, UserDict):
-    pass
+    def __len__(self):  # the dict knows its size: No need to count keys
+        return len(self.data)
+
+    # Bulk operations go directly to the underlying dict, skipping the per-item UserDict dispatch
+    def getmany(self, keys):
+        data = self.data
+        return [data[k] for k in keys]
+
+    def setmany(self, items):
+        self.data.update(items_of(items))
+
+    def delmany(self, keys):
+        data = self.data
+        for k in keys:
+            del data[k]
 
 
 class DictPickleStore(Store):
     """Completely useless store on it's own since a dict can store python objects as is, so
     there's no need to pickle the objects to store them.
-    Yet, this store exists to demonstrate how we can mix a persister and a val wrap"""
+    Yet, this store exists to demonstrate how we can mix a persister and a val wrap.
+    With out_of_band=True, big buffers are pickled out-of-band (see OutOfBandPickleValWrap)."""
 
-    def __init__(self, protocol=None, fix_imports=True):
+    def __init__(self, protocol=None, fix_imports=True, out_of_band=False):
         persister = DictPersister()
-        val_wrap = PickleValWrap(protocol=protocol, fix_imports=fix_imports)
+        val_wrap = _pickle_val_wrap(protocol, fix_imports, out_of_band)
         super().__init__(persister=persister, _data_of_obj=val_wrap._data_of_obj, _obj_of_data=val_wrap._obj_of_data)
 
 
@@ -161,6 +515,12 @@ class DictPickleStore(Store):
 import os
 import re
 from glob import iglob
+import mmap
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+
+from py2misc.py2store.streams import check_open_mode
+from py2misc.py2store.durability import DFLT_GROUP_COMMIT_WINDOW, GroupCommitter, fsync_path, tmp_filepath_for
 
 ########################################################################################################################
 # File system navigation: Utils
@@ -193,9 +553,65 @@ def iter_filepaths_in_folder_recursively(root_folder):
                 yield full_path
 
 
+def scan_dir(dirpath):
+    """The (non hidden) filepaths and dirpaths of dirpath, using the file type scandir gets with the names"""
+    filepaths, dirpaths = [], []
+    try:
+        with os.scandir(dirpath) as dir_entries:
+            for entry in dir_entries:
+                if entry.name.startswith('.'):
+                    continue  # skip hidden files and folders, as glob does
+                if entry.is_dir():
+                    dirpaths.append(entry.path)
+                elif entry.is_file():
+                    filepaths.append(entry.path)
+    except OSError:  # as glob does, ignore the directories we can't list (missing, not a directory, no permission...)
+        pass
+    return filepaths, dirpaths
+
+
+def scandir_filepaths(rootdir, max_workers=None):
+    """Yield the paths of all (non hidden) files under rootdir, recursively.
+
+    Same as iter_filepaths_in_folder_recursively, but uses os.scandir, whose entries already know if they're files or
+    directories, so no extra stat calls are made.
+    If max_workers is given, the (sibling) subdirectories of a same level are listed concurrently, in a pool of
+    max_workers threads. The directory tree is then walked breadth first (instead of depth first).
+    """
+    rootdir = ensure_slash_suffix(rootdir)
+    if not max_workers:
+        dirpaths = [rootdir]
+        while dirpaths:
+            filepaths, subdirpaths = scan_dir(dirpaths.pop())
+            yield from filepaths
+            dirpaths.extend(reversed(subdirpaths))
+    else:
+        with ThreadPoolExecutor(max_workers) as executor:
+            dirpaths = [rootdir]
+            while dirpaths:
+                next_level_dirpaths = []
+                for filepaths, subdirpaths in executor.map(scan_dir, dirpaths):
+                    yield from filepaths
+                    next_level_dirpaths.extend(subdirpaths)
+                dirpaths = next_level_dirpaths
+
+
 ########################################################################################################################
 # A simple file persister: This is just for illustrations/edmo sake.
 
+def mmap_read(filepath):
+    """Get the contents of a file as a read-only memoryview of a memory map of the file: No copy is made.
+    The file's pages are loaded (by the OS) as they're accessed, and shared with the other processes that map it."""
+    with open(filepath, 'rb') as fp:
+        if os.fstat(fp.fileno()).st_size == 0:
+            return memoryview(b'')  # can't mmap an empty file
+        # the map doesn't need the file to stay open, and is closed when the memoryview (and its copies) are gone
+        return memoryview(mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+FSYNC_POLICIES = ('none', 'per-write', 'group')
+
+
 class VerySimpleFilePersister(Persister):
     """Read/write (text or binary) data to files under a given rootdir.
     Keys must be absolute file paths.
@@ -240,12 +656,41 @@ class SimpleFilePersister(Persister):
     Keys must be absolute file paths.
     Paths that don't start with rootdir will be raise a KeyValidationError.
     Not the most efficient persister, but has the advantage of being simple.
+    Bulk operations (getmany, setmany, delmany) are done in a pool of max_workers threads.
+    Listing walks the rootdir with scandir_filepaths, concurrently if walk_max_workers is set.
+
+    With mode='m', data is written as binary, and read as a read-only memoryview of a memory map of the file
+    (see mmap_read), so big values aren't copied.
+
+    Writes are atomic: Data is written to a temporary file that is then renamed to the key's file, so readers never
+    see a partially written file. The fsync_policy says how durable the writes are (i.e. how much of them survives a
+    crash) before __setitem__ returns:
+        - 'none': No fsync. The OS will write the data to disk when it sees fit.
+        - 'per-write': The file is fsynced before the rename, and its directory after it. Durable, but slow.
+        - 'group': Same as 'per-write', but the fsyncs of concurrent writes (e.g. of setmany) are grouped
+            (see GroupCommitter), which is much faster when writing many small files.
     """
 
-    def __init__(self, rootdir, mode='t'):
+    max_workers = DFLT_MAX_WORKERS
+    walk_max_workers = None
+    group_commit_window = DFLT_GROUP_COMMIT_WINDOW
+    makedirs = False  # whether to create the (missing) directories of the files we write
+
+    def __init__(self, rootdir, mode='t', fsync_policy='none'):
         self.rootdir = ensure_slash_suffix(rootdir)
-        assert mode in {'t', 'b', ''}, f"mode ({mode}) not valid: Must be 't' or 'b'"
+        assert mode in {'t', 'b', '', 'm'}, f"mode ({mode}) not valid: Must be 't', 'b' or 'm' (mmap)"
+        assert fsync_policy in FSYNC_POLICIES, f"fsync_policy ({fsync_policy}) not valid: Must be in {FSYNC_POLICIES}"
         self.mode = mode
+        self.fsync_policy = fsync_policy
+        self._file_mode = 'b' if mode == 'm' else mode
+        if fsync_policy == 'group':
+            self._group_committer = GroupCommitter(self.group_commit_window)
+
+    def _writing(self):
+        """The context of a write: Registers it as in flight with the group committer (see GroupCommitter.writing)"""
+        if self.fsync_policy == 'group':
+            return self._group_committer.writing()
+        return nullcontext()
 
     def _is_valid_key(self, k):
         return k.startswith(self.rootdir)
@@ -254,16 +699,42 @@ class SimpleFilePersister(Persister):
         if not self._is_valid_key(k):
             raise KeyValidationError(f"Path ({k}) not valid. Must begin with {self.rootdir}")
 
-    def __getitem__(self, k):
-        self._validate_key(k)
-        with open(k, 'r' + self.mode) as fp:
+    def _read(self, k):
+        if self.mode == 'm':
+            return mmap_read(k)
+        with open(k, 'r' + self._file_mode) as fp:
             data = fp.read()
         return data
 
+    def _write(self, k, v):
+        with self._writing():
+            if self.makedirs:
+                os.makedirs(os.path.dirname(k), exist_ok=True)
+            tmp_filepath = tmp_filepath_for(k)
+            try:
+                with open(tmp_filepath, 'x' + self._file_mode) as fp:
+                    fp.write(v)
+                    if self.fsync_policy == 'per-write':
+                        fp.flush()
+                        os.fsync(fp.fileno())
+                if self.fsync_policy == 'group':
+                    self._group_committer.commit(tmp_filepath, k)
+                else:
+                    os.replace(tmp_filepath, k)
+                    if self.fsync_policy == 'per-write':
+                        fsync_path(os.path.dirname(k))
+            except BaseException:
+                if os.path.exists(tmp_filepath):
+                    os.remove(tmp_filepath)
+                raise
+
+    def __getitem__(self, k):
+        self._validate_key(k)
+        return self._read(k)
+
     def __setitem__(self, k, v):
         self._validate_key(k)
-        with open(k, 'w' + self.mode) as fp:
-            fp.write(v)
+        self._write(k, v)
 
     def __delitem__(self, k):
         self._validate_key(k)
@@ -274,7 +745,71 @@ class SimpleFilePersister(Persister):
         return os.path.isfile(k)
 
     def __iter__(self):
-        yield from filter(self._is_valid_key, filepaths_under_root(self.rootdir))
+        yield from filter(self._is_valid_key, scandir_filepaths(self.rootdir, self.walk_max_workers))
+
+    def open(self, k, mode='rb'):
+        """The (real) file object of k. Note that writes through it are neither atomic nor fsynced (whatever the
+        fsync_policy): They are made directly on the file."""
+        check_open_mode(mode)
+        self._validate_key(k)
+        if mode.startswith('w') and self.makedirs:
+            os.makedirs(os.path.dirname(k), exist_ok=True)
+        return open(k, mode)
+
+    def meta(self, k):
+        """The {'size': ..., 'mtime': ...} (bytes, and seconds since the epoch) of the file of k"""
+        self._validate_key(k)
+        try:
+            stat = os.stat(k)
+        except FileNotFoundError:
+            raise KeyError(k)
+        return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+    def getmany(self, keys):
+        keys = list(keys)
+        for k in keys:
+            self._validate_key(k)
+        with ThreadPoolExecutor(self.max_workers) as executor:
+            return list(executor.map(self._read, keys))
+
+    def setmany(self, items):
+        items = list(items_of(items))
+        for k, _ in items:
+            self._validate_key(k)
+        with ThreadPoolExecutor(self.max_workers) as executor:
+            list(executor.map(lambda item: self._write(*item), items))
+
+    def delmany(self, keys):
+        keys = list(keys)
+        for k in keys:
+            self._validate_key(k)
+        with ThreadPoolExecutor(self.max_workers) as executor:
+            list(executor.map(os.remove, keys))
+
+
+class CountedSimpleFilePersister(KeyCountMixin, SimpleFilePersister):
+    """A SimpleFilePersister whose __len__ doesn't walk the whole rootdir (but for the first time, or on resync_len)"""
+
+
+# (The modules of these extensions import this one, hence the imports in the functions)
+def file_key_wrap(rootdir, shard_levels=0):
+    """The key wrap of the files under rootdir: relative paths, hash sharded if shard_levels > 0"""
+    if shard_levels:
+        from py2misc.py2store.file_sharding import HashShardedRelativization
+        return HashShardedRelativization(_prefix=rootdir, shard_levels=shard_levels)
+    return PrefixRelativization(_prefix=rootdir)
+
+
+def _file_persister_cls(count_keys=False, index_keys=False):
+    if index_keys:
+        from py2misc.py2store.file_index import IndexedSimpleFilePersister
+        return IndexedSimpleFilePersister  # already knows its length, so no need to count keys
+    return CountedSimpleFilePersister if count_keys else SimpleFilePersister
+
+
+def _with_sorted_keys(persister):
+    from py2misc.py2store.sorted_keys import SortedKeysPersister
+    return SortedKeysPersister(persister)
 
 
 ########################################################################################################################
@@ -282,28 +817,51 @@ class SimpleFilePersister(Persister):
 class SimpleFileStore(Store):
     """A simple local file store that stores (either as text or as binary) under a root directory, with access
     keys expressed in relative paths.
+    If count_keys=True, the number of keys is maintained through writes and deletes (see KeyCountMixin),
+    instead of being counted at every len(store) call.
+    If index_keys=True, keys are listed (and looked up) from an index kept in a sidecar file
+    (see py2store.file_index), instead of walking the whole rootdir every time.
+    Writes are atomic, and as durable as fsync_policy says (see SimpleFilePersister).
+    If shard_levels > 0, files are fanned out in subdirectories named after the hash of their key
+    (see py2store.file_sharding, whose reshard_file_store converts an existing store's files).
+    If sorted_keys=True, keys are listed in sorted order, from an in-memory index (see py2store.sorted_keys), which
+    also serves keys(prefix=...) and keys(start=..., stop=...) (unless the store is sharded).
     """
 
-    def __init__(self, rootdir, mode='t'):
+    def __init__(self, rootdir, mode='t', count_keys=False, index_keys=False, fsync_policy='none', shard_levels=0,
+                 sorted_keys=False):
         rootdir = ensure_slash_suffix(rootdir)
-        persister = SimpleFilePersister(rootdir, mode)
-        key_wrap = PrefixRelativization(_prefix=rootdir)
-        super().__init__(persister=persister, _id_of_key=key_wrap._id_of_key, _key_of_id=key_wrap._key_of_id)
+        persister = _file_persister_cls(count_keys, index_keys)(rootdir, mode, fsync_policy)
+        persister.makedirs = shard_levels > 0
+        if sorted_keys:
+            persister = _with_sorted_keys(persister)
+        key_wrap = file_key_wrap(rootdir, shard_levels)
+        super().__init__(persister=persister, _id_of_key=key_wrap._id_of_key, _key_of_id=key_wrap._key_of_id,
+                         _id_of_key_prefix=key_wrap._id_of_key_prefix)
 
 
 class PickleFileStore(Store):
     """A simple local file store that stores (either as text or as binary) under a root directory, with access
     keys expressed in relative paths.
+    With mode='m', the pickles are unpickled straight from a memory map of the file, without reading it into bytes.
+    With out_of_band=True, big buffers are pickled out-of-band (see py2store.oob_pickle), which, with mode='m',
+    means that big numpy arrays are views of the memory mapped file.
+    See SimpleFileStore for the other arguments.
     """
 
-    def __init__(self, rootdir, mode='b', protocol=None, fix_imports=True):
+    def __init__(self, rootdir, mode='b', protocol=None, fix_imports=True, count_keys=False, index_keys=False,
+                 fsync_policy='none', shard_levels=0, out_of_band=False, sorted_keys=False):
         rootdir = ensure_slash_suffix(rootdir)
-        persister = SimpleFilePersister(rootdir, mode)
-        key_wrap = PrefixRelativization(_prefix=rootdir)
-        val_wrap = PickleValWrap(protocol=protocol, fix_imports=fix_imports)
+        persister = _file_persister_cls(count_keys, index_keys)(rootdir, mode, fsync_policy)
+        persister.makedirs = shard_levels > 0
+        if sorted_keys:
+            persister = _with_sorted_keys(persister)
+        key_wrap = file_key_wrap(rootdir, shard_levels)
+        val_wrap = _pickle_val_wrap(protocol, fix_imports, out_of_band)
         super().__init__(persister=persister,
                          _id_of_key=key_wrap._id_of_key, _key_of_id=key_wrap._key_of_id,
-                         _data_of_obj=val_wrap._data_of_obj, _obj_of_data=val_wrap._obj_of_data)
+                         _data_of_obj=val_wrap._data_of_obj, _obj_of_data=val_wrap._obj_of_data,
+                         _id_of_key_prefix=key_wrap._id_of_key_prefix)
 
 
 ########################################################################################################################
@@ -315,9 +873,10 @@ from botocore.client import Config
 from botocore.exceptions import ClientError
 import boto3
 
-
-class NoSuchKeyError(KeyError):
-    pass
+from py2misc.py2store.s3_io import (
+    NoSuchKeyError, S3ListingCache, iter_s3_keys, s3_key_of, s3_range_header, s3_upload_part, open_s3_object,
+    is_missing_key_error, S3_DELETE_OBJECTS_MAX_KEYS, S3_MULTIPART_MIN_CHUNKSIZE, S3_MULTIPART_MAX_PARTS,
+    DFLT_S3_MULTIPART_THRESHOLD, DFLT_S3_MULTIPART_CHUNKSIZE, DFLT_S3_PART_ATTEMPTS)
 
 
 encode_as_utf8 = partial(str, encoding='utf-8')
@@ -327,13 +886,15 @@ DFLT_AWS_S3_ENDPOINT = "https://s3.amazonaws.com"
 DFLT_BOTO_CLIENT_VERIFY = None
 DFLT_SIGNATURE_VERSION = 's3v4'
 DFLT_CONFIG = Config(signature_version=DFLT_SIGNATURE_VERSION)
+DFLT_S3_MAX_WORKERS = 16
 
 
 def get_s3_resource(aws_access_key_id,
                     aws_secret_access_key,
                     endpoint_url=DFLT_AWS_S3_ENDPOINT,
                     verify=DFLT_BOTO_CLIENT_VERIFY,
-                    config=DFLT_CONFIG):
+                    config=DFLT_CONFIG,
+                    max_pool_connections=None):
     """
     Get boto3 s3 resource.
     :param aws_access_key_id:
@@ -341,8 +902,12 @@ def get_s3_resource(aws_access_key_id,
     :param endpoint_url:
     :param verify:
     :param signature_version:
+    :param max_pool_connections: The size of the (http) connection pool of the resource's client. Should be at least
+        the number of threads that use the resource concurrently (if not, they'll wait for connections).
     :return:
     """
+    if max_pool_connections is not None:
+        config = config.merge(Config(max_pool_connections=max_pool_connections))
     return boto3.resource('s3',
                           endpoint_url=endpoint_url,
                           aws_access_key_id=aws_access_key_id,
@@ -351,92 +916,288 @@ def get_s3_resource(aws_access_key_id,
                           config=config)
 
 
+
+
 class S3BucketPersister(Persister):
-    def __init__(self, bucket_name: str, _s3_bucket, _prefix: str = ''):
+    """Read/write (bytes) data to the keys of an S3 bucket.
+    Concurrent operations (getmany, setmany, imap) share a pool of max_workers threads, which in turn share the
+    connection pool of the bucket's client: Make its max_pool_connections at least max_workers
+    (see get_s3_resource). The pool is made when first needed, and shut down by close() (or by using the persister
+    as a context manager).
+    Keys are (full) key strings, as listed (see list_keys): boto3 s3.Objects are accepted too (see s3_key_of).
+    All requests are made through the bucket's client, which (unlike boto3 resources) can be shared by threads.
+    If listing_ttl is given, listings are cached for that many seconds (or until this persister writes or deletes).
+    Values of multipart_threshold bytes or more are uploaded in parts of multipart_chunksize bytes, max_workers at a
+    time, each part being attempted up to part_attempts times. read_range reads only a part of a value.
+    """
+    multipart_threshold = DFLT_S3_MULTIPART_THRESHOLD
+    multipart_chunksize = DFLT_S3_MULTIPART_CHUNKSIZE
+    part_attempts = DFLT_S3_PART_ATTEMPTS
+
+    def __init__(self, bucket_name: str, _s3_bucket, _prefix: str = '', max_workers=DFLT_S3_MAX_WORKERS,
+                 listing_ttl=None):
         self.bucket_name = bucket_name
         self._s3_bucket = _s3_bucket
+        self._client = _s3_bucket.meta.client
         self._prefix = _prefix
+        self.max_workers = max_workers
+        self._executor = None
+        self.listing_cache = S3ListingCache(listing_ttl) if listing_ttl else None
+
+    @property
+    def executor(self):
+        """The (lazily made) thread pool shared by the concurrent operations"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.max_workers)
+        return self._executor
+
+    def imap(self, func, iterable):
+        """Apply func to the items of iterable concurrently (in the thread pool), yielding results in order"""
+        return imap_ordered(func, iterable, self.executor, n_ahead=2 * self.max_workers)
+
+    def close(self):
+        """Shut down the thread pool (if it was made). A later concurrent operation makes a new one."""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
 
     def __getitem__(self, k):
         try:
-            return k.get()['Body'].read()
-        except Exception as e:
-            raise NoSuchKeyError(f"Key wasn't found: {k}")
+            return self._client.get_object(Bucket=self.bucket_name, Key=s3_key_of(k))['Body'].read()
+        except ClientError as e:
+            if is_missing_key_error(e):
+                raise NoSuchKeyError(f"Key wasn't found: {k}")
+            raise
+
+    def open(self, k, mode='rb'):
+        """A file-like object to stream the value of k from, or to (see open_s3_object)"""
+        if mode.startswith('w'):
+            self._clear_listing_cache()
+        return open_s3_object(self._client, self.bucket_name, s3_key_of(k), mode,
+                              chunksize=self.multipart_chunksize, on_close=self._clear_listing_cache)
+
+    def read_range(self, k, start=0, stop=None):
+        """The bytes start:stop of the value of k, read with a ranged GET (see s3_range_header)"""
+        try:
+            return self._client.get_object(Bucket=self.bucket_name, Key=s3_key_of(k),
+                                           Range=s3_range_header(start, stop))['Body'].read()
+        except ClientError as e:
+            if is_missing_key_error(e):
+                raise NoSuchKeyError(f"Key wasn't found: {k}")
+            raise
 
     def __setitem__(self, k, v):
-        k.put(Body=v)
+        if isinstance(v, (bytes, bytearray, memoryview)) and len(v) >= self.multipart_threshold:
+            self._multipart_put(k, v)
+        else:
+            self._client.put_object(Bucket=self.bucket_name, Key=s3_key_of(k), Body=v)
+        self._clear_listing_cache()
+
+    def _multipart_put(self, k, v):
+        client, key = self._client, s3_key_of(k)
+        v = memoryview(v).cast('B')
+        chunksize = max(self.multipart_chunksize, S3_MULTIPART_MIN_CHUNKSIZE,
+                        -(-len(v) // S3_MULTIPART_MAX_PARTS))
+        upload_id = client.create_multipart_upload(Bucket=self.bucket_name, Key=key)['UploadId']
+
+        def upload_part(part_number):
+            offset = (part_number - 1) * chunksize
+            return s3_upload_part(client, self.bucket_name, key, upload_id, part_number,
+                                  bytes(v[offset:offset + chunksize]), self.part_attempts)
+
+        try:
+            # its own pool: this may run in a thread of self.executor (setmany), so it can't wait on that pool
+            with ThreadPoolExecutor(self.max_workers) as executor:
+                parts = list(executor.map(upload_part, range(1, -(-len(v) // chunksize) + 1)))
+            client.complete_multipart_upload(Bucket=self.bucket_name, Key=key, UploadId=upload_id,
+                                             MultipartUpload={'Parts': parts})
+        except BaseException:
+            client.abort_multipart_upload(Bucket=self.bucket_name, Key=key, UploadId=upload_id)
+            raise
 
     def __delitem__(self, k):
         try:
-            k.delete()
-        except Exception as e:
-            if hasattr(e, '__name__'):
-                if e.__name__ == 'NoSuchKey':
-                    raise NoSuchKeyError(f"Key wasn't found: {k}")
-            raise  # if you got so far
+            self._client.delete_object(Bucket=self.bucket_name, Key=s3_key_of(k))
+        except ClientError as e:
+            if is_missing_key_error(e):
+                raise NoSuchKeyError(f"Key wasn't found: {k}")
+            raise
+        finally:
+            self._clear_listing_cache()
+
+    # Listing #########################################################################################################
+    def _list_keys(self, prefix, delimiter):
+        return iter_s3_keys(self._client, self.bucket_name, prefix, delimiter)
+
+    def list_keys(self, prefix='', delimiter=None):
+        """The (full) keys under self._prefix + prefix, as strings. See iter_s3_keys for delimiter."""
+        prefix = self._prefix + prefix
+        if self.listing_cache is None:
+            return self._list_keys(prefix, delimiter)
+        return iter(self.listing_cache.get(self._list_keys, prefix, delimiter))
+
+    def iter_prefix(self, id_prefix):
+        """The (full) keys that start with id_prefix (which must start with self._prefix), listed by S3, in order"""
+        assert id_prefix.startswith(self._prefix), f"{id_prefix} is not under {self._prefix}"
+        return self.list_keys(id_prefix[len(self._prefix):])
+
+    def iter_range(self, start=None, stop=None):
+        """The (full) keys k such that start <= k < stop. S3 lists keys in order, so the listing starts (S3 side) at
+        start (which, being inclusive, is checked with a head_object), and stops at stop: Only the keys of the range
+        are listed. Cached listings (see listing_ttl) are filtered instead."""
+        if start is not None and self.listing_cache is None:
+            if start.startswith(self._prefix) and self.__contains__(start):
+                if stop is None or start < stop:
+                    yield start
+            keys = iter_s3_keys(self._client, self.bucket_name, self._prefix, start_after=start)
+        else:
+            keys = self.list_keys()
+        for k in keys:
+            if stop is not None and k >= stop:
+                break
+            if start is None or k >= start:
+                yield k
+
+    def _clear_listing_cache(self):
+        if self.listing_cache is not None:
+            self.listing_cache.clear()
 
     def __iter__(self):
-        return iter(self._s3_bucket.objects.filter(Prefix=self._prefix))
+        return self.list_keys()
 
     def __contains__(self, k):
-        try:
-            k.load()
+        try:  # a (client) head_object request, which doesn't load the resource's attributes as k.load() does
+            self._client.head_object(Bucket=self.bucket_name, Key=s3_key_of(k))
             return True  # if all went well
         except ClientError as e:
-            if e.response['Error']['Code'] == "404":
+            if is_missing_key_error(e):
                 # The object does not exist.
                 return False
             else:
                 # Something else has gone wrong.
                 raise
 
+    def meta(self, k):
+        """The {'size': ..., 'etag': ..., 'mtime': ...} of k, from a head_object request (no data is read)"""
+        try:
+            response = self._client.head_object(Bucket=self.bucket_name, Key=s3_key_of(k))
+        except ClientError as e:
+            if is_missing_key_error(e):
+                raise NoSuchKeyError(f"Key wasn't found: {k}")
+            raise
+        return {'size': response['ContentLength'],
+                'etag': response['ETag'].strip('"'),
+                'mtime': response['LastModified'].timestamp()}
+
+    # Bulk operations: Concurrent gets and puts, and batched deletes ###################################################
+    def getmany(self, keys):
+        return list(self.imap(self.__getitem__, keys))
+
+    def setmany(self, items):
+        for _ in self.imap(lambda item: self.__setitem__(*item), items_of(items)):
+            pass
+
+    def delmany(self, keys):
+        for chunk in chunks(keys, S3_DELETE_OBJECTS_MAX_KEYS):
+            response = self._client.delete_objects(
+                Bucket=self.bucket_name, Delete={'Objects': [{'Key': s3_key_of(k)} for k in chunk], 'Quiet': True})
+            self._clear_listing_cache()
+            errors = response.get('Errors')
+            if errors:
+                raise ClientError({'Error': errors[0]}, 'DeleteObjects')
+
     @classmethod
-    def from_s3_resource_kwargs(cls, bucket_name, _prefix: str = '', **kwargs):
+    def from_s3_resource_kwargs(cls, bucket_name, _prefix: str = '', max_workers=DFLT_S3_MAX_WORKERS,
+                                listing_ttl=None, **kwargs):
+        kwargs['max_pool_connections'] = kwargs.get('max_pool_connections') or max_workers
         s3_resource = get_s3_resource(**kwargs)
-        return cls.from_s3_resource(bucket_name, s3_resource, _prefix=_prefix)
+        return cls.from_s3_resource(bucket_name, s3_resource, _prefix=_prefix, max_workers=max_workers,
+                                    listing_ttl=listing_ttl)
 
     @classmethod
     def from_s3_resource(cls,
                          bucket_name,
                          s3_resource,
-                         _prefix=''
+                         _prefix='',
+                         max_workers=DFLT_S3_MAX_WORKERS,
+                         listing_ttl=None
                          ):
         s3_bucket = s3_resource.Bucket(bucket_name)
-        return cls(bucket_name, s3_bucket, _prefix=_prefix)
+        return cls(bucket_name, s3_bucket, _prefix=_prefix, max_workers=max_workers, listing_ttl=listing_ttl)
 
 
 class S3Store(Store):
+    """A store of an S3 bucket's data, with (prefix relative) string keys.
+    keys(), values() and items() are there too, values being fetched concurrently (but yielded in key order), by
+    max_workers threads.
+    If listing_ttl is given, the listings of keys are cached for that many seconds (see S3BucketPersister).
+    keys(prefix=...) only lists the keys with that prefix (S3 does the filtering). With sorted_keys=True, the keys are
+    kept in an in-memory index (see py2store.sorted_keys), so that keys(...) doesn't list anything at all.
+    """
+
     def __init__(self, bucket_name: str, _s3_bucket, _prefix: str = '',
-                 _data_of_obj=lambda x: x, _obj_of_data=DFLT_S3_OBJ_OF_DATA):
-        persister = S3BucketPersister(bucket_name, _s3_bucket, _prefix)
+                 _data_of_obj=identity_func, _obj_of_data=DFLT_S3_OBJ_OF_DATA, max_workers=DFLT_S3_MAX_WORKERS,
+                 listing_ttl=None, sorted_keys=False):
+        persister = S3BucketPersister(bucket_name, _s3_bucket, _prefix, max_workers=max_workers,
+                                      listing_ttl=listing_ttl)
         key_wrap = PrefixRelativization(_prefix=persister._prefix)
-
-        def _id_of_key(k):
-            """Gets an 's3 bucket object' for a corresponding string key"""
-            return persister._s3_bucket.Object(key=key_wrap._id_of_key(k))
-
-        def _key_of_id(_id):  # transforms a string key into an s3 object
-            """Gets the string key of a 's3 bucket object'"""
-            return key_wrap._key_of_id(_id.key)
+        if sorted_keys:
+            persister = _with_sorted_keys(persister)
 
         super().__init__(persister=persister,
-                         _id_of_key=_id_of_key,
-                         _key_of_id=_key_of_id,
+                         _id_of_key=key_wrap._id_of_key,  # the persister's keys are (full) s3 key strings
+                         _key_of_id=key_wrap._key_of_id,
                          _data_of_obj=_data_of_obj,
-                         _obj_of_data=_obj_of_data
+                         _obj_of_data=_obj_of_data,
+                         _id_of_key_prefix=key_wrap._id_of_key_prefix
                          )
 
+    def items(self):
+        return self.persister.imap(lambda k: (k, self[k]), iter(self))
+
+    def values(self):
+        return (v for _, v in self.items())
+
+    def read_range(self, k, start=0, stop=None):
+        """The bytes start:stop of the data of k (as stored: not deserialized by _obj_of_data), read with a ranged GET.
+        For example, store.read_range(k, -1000) reads the last 1000 bytes only."""
+        return self.persister.read_range(self._id_of_key(k), start, stop)
+
+    def dirs(self, delimiter='/'):
+        """A directory-like view of the store (see S3DirStore)"""
+        return S3DirStore(self.persister, delimiter=delimiter)
+
+    def close(self):
+        """Shut down the thread pool of the persister (see S3BucketPersister.close)"""
+        self.persister.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
     @classmethod
     def from_s3_resource_kwargs(cls,
                                 bucket_name,
                                 _prefix: str = '',
-                                _data_of_obj=lambda x: x,
+                                _data_of_obj=identity_func,
                                 _obj_of_data=DFLT_S3_OBJ_OF_DATA,
+                                max_workers=DFLT_S3_MAX_WORKERS,
+                                listing_ttl=None,
                                 **kwargs
                                 ):
+        kwargs['max_pool_connections'] = kwargs.get('max_pool_connections') or max_workers
         s3_resource = get_s3_resource(**kwargs)
         return cls.from_s3_resource(bucket_name, s3_resource, _prefix=_prefix,
-                                    _data_of_obj=_data_of_obj, _obj_of_data=_obj_of_data)
+                                    _data_of_obj=_data_of_obj, _obj_of_data=_obj_of_data, max_workers=max_workers,
+                                    listing_ttl=listing_ttl)
 
     @classmethod
     def from_s3_resource(cls, bucket_name, s3_resource, **kwargs):
@@ -444,6 +1205,45 @@ class S3Store(Store):
         return cls(bucket_name, s3_bucket, **kwargs)
 
 
+class S3DirStore:
+    """A (read-only) directory-like view of the keys of an S3BucketPersister, as DirStoreLeveled (of py2store.kv) is
+    for local folders: The keys are the (relative) "subdirectories" (ending with delimiter) right under _prefix, and
+    the values are the S3DirStore of these. The (non-directory) keys right under _prefix are listed by files().
+    Listings are made with a delimiter, so only the keys of the "level" are listed, not all the keys under it.
+    All levels share the persister (so its listing cache too).
+    """
+
+    def __init__(self, persister, _prefix='', delimiter='/'):
+        self.persister = persister
+        self._prefix = _prefix
+        self.delimiter = delimiter
+
+    def _list(self):
+        start = len(self.persister._prefix) + len(self._prefix)
+        for k in self.persister.list_keys(self._prefix, delimiter=self.delimiter):
+            yield k[start:]
+
+    def __iter__(self):
+        return (k for k in self._list() if k.endswith(self.delimiter))
+
+    def files(self):
+        return (k for k in self._list() if not k.endswith(self.delimiter))
+
+    def __contains__(self, k):
+        return k.endswith(self.delimiter) and k in set(self)
+
+    def __getitem__(self, k):
+        if k not in self:
+            raise NoSuchKeyError(f"No such key (perhaps it's not a directory?): {k}")
+        return self.__class__(self.persister, self._prefix + k, self.delimiter)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}('{self.persister._prefix + self._prefix}')"
+
+
 ########################################################################################################################
 ########################################################################################################################
 # Testing functions
@@ -562,9 +1362,32 @@ def _test_len(store):
     _delete_keys_from_store(s, ['_foo', '_hello'])
 
 
+def _test_bulk_ops(store):
+    s = store  # just to be able to use shorthand "s"
+
+    _delete_keys_from_store(s, ['_foo', '_hello'])
+
+    s.setmany({'_foo': 'bar', '_hello': 'world'})
+    assert s['_foo'] == 'bar' and s['_hello'] == 'world'
+    assert s.getmany(['_hello', '_foo']) == ['world', 'bar']  # values come in the order of the keys asked for
+
+    s.setmany([('_foo', 'a different value')])  # pairs work too
+    assert s.getmany(['_foo']) == ['a different value']
+
+    try:
+        s.delmany(['_foo', '_hello'])
+        assert '_foo' not in s and '_hello' not in s
+    except DeletionsNotAllowed:
+        pass
+
+    _delete_keys_from_store(s, ['_foo', '_hello'])
+
+
 def _multi_test(store):
     _test_ops_on_store(store)
     _test_len(store)
+    if hasattr(store, 'getmany'):
+        _test_bulk_ops(store)
 
 
 def test_dict_ops():
@@ -576,6 +1399,9 @@ def test_local_file_ops():
     store = DictPickleStore()
     _multi_test(store)
 
+    store = DictPickleStore(out_of_band=True)
+    _multi_test(store)
+
     import os
     import shutil
     from tempfile import gettempdir
@@ -588,10 +1414,71 @@ def test_local_file_ops():
 
     store = SimpleFileStore(rootdir=rootdir)
     _multi_test(store)
+    with store.open('_streamed', 'w') as fp:
+        for line in ['streamed\n', 'lines\n']:
+            fp.write(line)
+    assert store['_streamed'] == 'streamed\nlines\n'
+    with store.open('_streamed', 'r') as fp:
+        assert list(fp) == ['streamed\n', 'lines\n']
+    del store['_streamed']
 
     store = PickleFileStore(rootdir=rootdir)
     _multi_test(store)
 
+    store = PickleFileStore(rootdir=rootdir, mode='m')
+    _multi_test(store)
+
+    store = PickleFileStore(rootdir=rootdir, mode='m', out_of_band=True)
+    _multi_test(store)
+
+    store = SimpleFileStore(rootdir=rootdir, fsync_policy='per-write')
+    _multi_test(store)
+
+    store = PickleFileStore(rootdir=rootdir, fsync_policy='group')
+    _multi_test(store)
+
+    store = SimpleFileStore(rootdir=rootdir, count_keys=True)
+    _multi_test(store)
+    n = len(store)
+    with open(os.path.join(rootdir, '_written_behind_the_stores_back'), 'w') as fp:
+        fp.write('boo')
+    assert len(store) == n  # the count doesn't see writes that didn't go through the store...
+    assert store.persister.resync_len() == n + 1  # ... until it's resynced
+    os.remove(os.path.join(rootdir, '_written_behind_the_stores_back'))
+
+    store = SimpleFileStore(rootdir=rootdir, index_keys=True)
+    _multi_test(store)
+    n = len(store)
+    os.mkdir(os.path.join(rootdir, '_subdir'))
+    with open(os.path.join(rootdir, '_subdir', '_written_behind_the_stores_back'), 'w') as fp:
+        fp.write('boo')
+    assert '_subdir/_written_behind_the_stores_back' in list(store)  # the change was seen by the refresh...
+    assert len(SimpleFileStore(rootdir=rootdir, index_keys=True)) == n + 1  # ... and saved in the index
+    shutil.rmtree(os.path.join(rootdir, '_subdir'))
+    assert len(store) == n
+
+    store = SimpleFileStore(rootdir=rootdir, sorted_keys=True)
+    _multi_test(store)
+    store.setmany({'_s2_a': '', '_s1_b': '', '_s1_a': '', '_s10_a': ''})
+    assert list(store.keys(prefix='_s1_')) == ['_s1_a', '_s1_b']
+    assert list(store.keys(start='_s10', stop='_s1_b')) == ['_s10_a', '_s1_a']
+    assert list(SimpleFileStore(rootdir=rootdir).keys(prefix='_s1_')) == ['_s1_a', '_s1_b']  # (no index: filtered)
+    store.delmany(['_s2_a', '_s1_b', '_s1_a', '_s10_a'])
+
+    sharded_rootdir = os.path.join(rootdir, '_sharded')
+    os.mkdir(sharded_rootdir)
+    store = SimpleFileStore(rootdir=sharded_rootdir, shard_levels=2)
+    _multi_test(store)
+    store['_foo'] = 'bar'
+    assert list(store) == ['_foo']
+    assert list(scandir_filepaths(sharded_rootdir)) != [os.path.join(sharded_rootdir, '_foo')]
+    from py2misc.py2store.file_sharding import reshard_file_store
+    reshard_file_store(sharded_rootdir, shard_levels=0, from_shard_levels=2)
+    assert list(scandir_filepaths(sharded_rootdir)) == [os.path.join(sharded_rootdir, '_foo')]
+    reshard_file_store(sharded_rootdir, shard_levels=2)
+    assert list(store) == ['_foo'] and store['_foo'] == 'bar'
+    shutil.rmtree(sharded_rootdir)
+
 
 if __name__ == '__main__':
     import pytest
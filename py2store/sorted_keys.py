@@ -0,0 +1,133 @@
+"""
+Sorted listings of keys: SortedKeysPersister keeps a sorted index of the keys of a persister, so that its keys are
+listed in order, and those of a range (or with a prefix) are listed without listing all the others.
+"""
+
+from bisect import bisect_left
+
+from py2misc.py2store.simple import Persister, items_of, getmany_of, setmany_of, delmany_of, open_of
+
+class SortedKeyIndex:
+    """A sorted array of (comparable) keys, for O(log n + k) range and prefix scans (with bisect).
+    Adding and removing keys is O(n) (a memmove), but that's fast for even a few million keys.
+
+    >>> index = SortedKeyIndex(['s2/b', 's1/a', 's10/a', 's1/b'])
+    >>> list(index.irange('s1/', 's2/'))
+    ['s1/a', 's1/b', 's10/a']
+    >>> list(index.iprefix('s1/'))
+    ['s1/a', 's1/b']
+    """
+
+    def __init__(self, keys=()):
+        self._keys = sorted(set(keys))
+
+    def add(self, k):
+        i = bisect_left(self._keys, k)
+        if i == len(self._keys) or self._keys[i] != k:
+            self._keys.insert(i, k)
+
+    def discard(self, k):
+        i = bisect_left(self._keys, k)
+        if i < len(self._keys) and self._keys[i] == k:
+            del self._keys[i]
+
+    def __contains__(self, k):
+        i = bisect_left(self._keys, k)
+        return i < len(self._keys) and self._keys[i] == k
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def irange(self, start=None, stop=None):
+        """The keys k such that start <= k < stop (no bound if None), in order"""
+        i = 0 if start is None else bisect_left(self._keys, start)
+        j = len(self._keys) if stop is None else bisect_left(self._keys, stop)
+        return iter(self._keys[i:j])
+
+    def iprefix(self, prefix):
+        """The keys that start with prefix, in order"""
+        keys = self._keys
+        i = bisect_left(keys, prefix)
+        while i < len(keys) and keys[i].startswith(prefix):
+            yield keys[i]
+            i += 1
+
+
+class SortedKeysPersister(Persister):
+    """A wrapper of a persister that keeps a SortedKeyIndex of its keys, so that it lists its keys in sorted order,
+    and can list those in a range (iter_range) or with a prefix (iter_prefix) without listing all keys.
+
+    The index is built (by listing all keys) the first time it's needed, and then kept up to date by the writes and
+    deletes made through the wrapper. Writes and deletes made through other means will not be seen: call
+    resync_index to re-list. __contains__ and __len__ are answered by the index.
+    """
+
+    def __init__(self, persister):
+        self.persister = persister
+        self._index = None
+
+    @property
+    def index(self):
+        if self._index is None:
+            self.resync_index()
+        return self._index
+
+    def resync_index(self):
+        """Rebuild the index (by listing all keys of the persister)"""
+        self._index = SortedKeyIndex(self.persister)
+        return self._index
+
+    def iter_range(self, start=None, stop=None):
+        return self.index.irange(start, stop)
+
+    def iter_prefix(self, prefix):
+        return self.index.iprefix(prefix)
+
+    def __getitem__(self, k):
+        return self.persister[k]
+
+    def __setitem__(self, k, v):
+        self.persister[k] = v
+        self.index.add(k)
+
+    def __delitem__(self, k):
+        del self.persister[k]
+        self.index.discard(k)
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, k):
+        return k in self.index
+
+    def getmany(self, keys):
+        return getmany_of(self.persister, keys)
+
+    def setmany(self, items):
+        items = list(items_of(items))
+        setmany_of(self.persister, items)
+        for k, _ in items:
+            self.index.add(k)
+
+    def delmany(self, keys):
+        keys = list(keys)
+        delmany_of(self.persister, keys)
+        for k in keys:
+            self.index.discard(k)
+
+    def open(self, k, mode='rb'):
+        f = open_of(self.persister, k, mode)
+        if mode.startswith('w'):
+            self.index.add(k)
+        return f
+
+    def __getattr__(self, attr):  # so that the persister's other attributes (and methods) are still reachable
+        if attr == 'persister':
+            raise AttributeError(attr)
+        return getattr(self.persister, attr)
@@ -0,0 +1,64 @@
+"""
+File-like objects for stores: In-memory ones, on the values of stores that can't stream (see open_in_memory), and
+wrappers of the file objects of those that can.
+"""
+
+import io
+
+def check_open_mode(mode):
+    if mode not in {'r', 'rt', 'rb', 'w', 'wt', 'wb'}:
+        raise ValueError(f"Unsupported mode: {mode!r}. Must be one of 'r', 'rt', 'rb', 'w', 'wt' or 'wb'")
+
+
+class _WriteOnClose:
+    """A mixin for io.BytesIO and io.StringIO that writes the (whole) content to a mapping, when closed"""
+
+    def __init__(self, mapping, k):
+        super().__init__()
+        self._mapping, self._k = mapping, k
+
+    def close(self):
+        if not self.closed:
+            self._mapping[self._k] = self.getvalue()
+        super().close()
+
+
+class _BytesWriteOnClose(_WriteOnClose, io.BytesIO):
+    pass
+
+
+class _StringWriteOnClose(_WriteOnClose, io.StringIO):
+    pass
+
+
+def open_in_memory(mapping, k, mode='rb'):
+    """A file-like object on the value of mapping[k]: an io.BytesIO (or io.StringIO, in text mode) of the value, in
+    read mode, and one that is written to mapping[k] when it's closed, in write mode."""
+    check_open_mode(mode)
+    if mode.startswith('r'):
+        return io.BytesIO(mapping[k]) if 'b' in mode else io.StringIO(mapping[k])
+    return _BytesWriteOnClose(mapping, k) if 'b' in mode else _StringWriteOnClose(mapping, k)
+
+
+class CallOnClose:
+    """A file-like object that wraps f, and calls on_close() when f is closed (once)"""
+
+    def __init__(self, f, on_close):
+        self._f, self._on_close = f, on_close
+
+    def close(self):
+        if not self._f.closed:
+            self._f.close()
+            self._on_close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __iter__(self):
+        return iter(self._f)
+
+    def __getattr__(self, attr):
+        return getattr(self._f, attr)